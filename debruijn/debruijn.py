@@ -14,10 +14,27 @@
 """Perform assembly based on debruijn graph."""
 
 import argparse
+import bz2
+import contextlib
+import glob
+import gzip
+import hashlib
+import itertools
+import lzma
+import math
+import mmap
+import multiprocessing
 import os
+import queue
+import shutil
 import sys
+import tempfile
+import threading
+import time
 import networkx as nx
+import numpy as np
 import matplotlib
+from collections.abc import ItemsView, Mapping
 from operator import itemgetter
 import random
 random.seed(9001)
@@ -36,95 +53,3269 @@ __maintainer__ = "Your Name"
 __email__ = "your@email.fr"
 __status__ = "Developpement"
 
+def memory_size(size):
+    """Convert a memory size such as 512M or 4G into bytes.
+
+    :param size: (str) A number of bytes, with an optional K, M, G or T unit.
+    :raises ArgumentTypeError: If the size is not valid
+    :return: (int) Number of bytes
+    """
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+    text = size.strip().upper().rstrip("B")
+    factor = 1
+    if text[-1:] in units:
+        factor = units[text[-1]]
+        text = text[:-1]
+    try:
+        value = int(float(text) * factor)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "{0} is not a valid memory size.".format(size)) from None
+    if value <= 0:
+        raise argparse.ArgumentTypeError(
+            "{0} is not a valid memory size.".format(size))
+    return value
+
+
+def count_threshold(value):
+    """Convert a minimum kmer count, a positive integer or auto.
+
+    :param value: (str) A positive integer, or auto.
+    :raises ArgumentTypeError: If the value is not valid
+    :return: (int) The minimum count, or the string auto
+    """
+    if value.strip().lower() == "auto":
+        return "auto"
+    try:
+        count = int(value)
+    except ValueError:
+        count = 0
+    if count <= 0:
+        raise argparse.ArgumentTypeError(
+            "{0} is not a valid minimum count.".format(value))
+    return count
+
+
+def positive_int(value):
+    """Convert a strictly positive integer.
+
+    :param value: (str) A positive integer.
+    :raises ArgumentTypeError: If the value is not valid
+    :return: (int) The integer
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number <= 0:
+        raise argparse.ArgumentTypeError(
+            "{0} is not a positive integer.".format(value))
+    return number
+
+
+def non_negative_int(value):
+    """Convert a positive or null integer.
+
+    :param value: (str) A positive or null integer.
+    :raises ArgumentTypeError: If the value is not valid
+    :return: (int) The integer
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        number = -1
+    if number < 0:
+        raise argparse.ArgumentTypeError(
+            "{0} is not a positive or null integer.".format(value))
+    return number
+
+
 def isfile(path): # pragma: no cover
     """Check if path is an existing file.
 
-    :param path: (str) Path to the file
-    
-    :raises ArgumentTypeError: If file doesn't exist
-    
-    :return: (str) Path 
+    :param path: (str) Path to the file
+    
+    :raises ArgumentTypeError: If file doesn't exist
+    
+    :return: (str) Path 
+    """
+    if not os.path.isfile(path):
+        if os.path.isdir(path):
+            msg = "{0} is a directory".format(path)
+        else:
+            msg = "{0} does not exist.".format(path)
+        raise argparse.ArgumentTypeError(msg)
+    return path
+
+
+def get_arguments(): # pragma: no cover
+    """Retrieves the arguments of the program.
+
+    :return: An object that contains the arguments
+    """
+    # Parsing arguments
+    parser = argparse.ArgumentParser(description=__doc__, usage=
+                                     "{0} -h"
+                                     .format(sys.argv[0]))
+    parser.add_argument('-i', dest='fastq_file', nargs='+',
+                        help="Fastq or fasta files (plain, gzip, bzip2 or xz), glob "
+                        "patterns or - for standard input (required unless "
+                        "--merge is given)")
+    parser.add_argument('-k', dest='kmer_size', type=int,
+                        default=22, help="k-mer size (default 22)")
+    parser.add_argument('-t', '--threads', dest='threads', type=int,
+                        default=1, help="Number of counting processes, k-mers "
+                        "being sharded between them (default 1)")
+    parser.add_argument('--index', dest='index_reads', action='store_true',
+                        help="Split uncompressed fastq files between the "
+                        "counting processes on a record index saved next to "
+                        "them (.fqi) and reused by later runs")
+    parser.add_argument('--cache', dest='cache_dir', type=str,
+                        help="Directory of a 2-bit packed read cache reused "
+                        "by later runs on the same reads")
+    parser.add_argument('--min-quality', dest='min_quality',
+                        type=non_negative_int,
+                        help="Trim reads at the first window of mean Phred "
+                        "quality below this value")
+    parser.add_argument('--window', dest='window', type=positive_int,
+                        default=4,
+                        help="Size of the quality trimming window (default 4)")
+    parser.add_argument('--min-length', dest='min_length',
+                        type=non_negative_int,
+                        default=0, help="Drop reads (or parts of reads split "
+                        "at N bases) shorter than this length (default 0)")
+    parser.add_argument('--normalize', dest='coverage', type=int,
+                        help="Digital normalization: drop reads whose median "
+                        "k-mer coverage already reaches this value")
+    parser.add_argument('--sketch-width', dest='sketch_width', type=int,
+                        default=1 << 22, help="Number of counters per row of "
+                        "the Count-Min sketch (default 4194304)")
+    parser.add_argument('--sketch-depth', dest='sketch_depth', type=int,
+                        default=4, help="Number of rows of the Count-Min "
+                        "sketch (default 4)")
+    parser.add_argument('--canonical', dest='canonical', action='store_true',
+                        help="Count each k-mer with its reverse complement, "
+                        "for reads of both strands")
+    parser.add_argument('--max-memory', dest='max_memory', type=memory_size,
+                        help="Count k-mers through bucket files on disk to "
+                        "stay within this memory (e.g. 512M, 4G)")
+    parser.add_argument('--tmp-dir', dest='tmp_dir', type=str,
+                        help="Directory of the bucket files (default system "
+                        "temporary directory)")
+    parser.add_argument('--bloom', dest='bloom_error_rate', type=float,
+                        nargs='?', const=0.01, help="Keep k-mers seen once "
+                        "out of the table with a Bloom filter of this false "
+                        "positive rate (default 0.01)")
+    parser.add_argument('--approximate', dest='approximate', type=int,
+                        nargs='?', const=2, help="Count k-mers approximately "
+                        "in a Count-Min sketch (see --sketch-width and "
+                        "--sketch-depth), keeping the k-mers seen at least "
+                        "this number of times (default 2)")
+    parser.add_argument('--min-count', dest='min_count', type=count_threshold,
+                        help="Remove the k-mers seen fewer times before "
+                        "building the graph, auto to take the valley of the "
+                        "abundance histogram")
+    parser.add_argument('--histogram', dest='histogram_file', type=str,
+                        help="Write the k-mer abundance histogram (TSV)")
+    parser.add_argument('--suggest-k', dest='kmer_sizes', type=int, nargs='+',
+                        help="Compare these k-mer sizes on a sample of the "
+                        "reads, print the one giving the most solid k-mers "
+                        "and exit")
+    parser.add_argument('--sample', dest='sample_size', type=int,
+                        default=100000, help="Number of reads of the sample "
+                        "of --suggest-k (default 100000)")
+    parser.add_argument('--presize', dest='presize', action='store_true',
+                        help="Estimate the number of distinct k-mers in a "
+                        "first pass (HyperLogLog) to size the k-mer table, "
+                        "Bloom filter and bucket files up front")
+    parser.add_argument('--estimate-only', dest='estimate_only',
+                        action='store_true', help="Print the estimated "
+                        "number of distinct k-mers and table memory, and exit")
+    parser.add_argument('--engine', dest='engine', choices=("hash", "sort"),
+                        default="hash", help="Count k-mers in a hash table "
+                        "or by sorting runs of k-mers (default hash)")
+    parser.add_argument('--pipeline', dest='pipeline', action='store_true',
+                        help="Read, encode and count the reads in three "
+                        "threads connected by bounded queues")
+    parser.add_argument('--benchmark', dest='benchmark', action='store_true',
+                        help="Time both counting engines on the reads and "
+                        "exit")
+    parser.add_argument('--save-table', dest='save_table_file', type=str,
+                        help="Save the k-mer counts as a sorted table file, "
+                        "mapped in memory by later runs (see --update)")
+    parser.add_argument('--update', dest='table_file', type=str,
+                        help="Count the reads into this stored k-mer table "
+                        "(created if missing) and save it back, the graph "
+                        "being built from the whole table")
+    parser.add_argument('--merge', dest='merge_tables', nargs='+',
+                        help="Add the counts of these k-mer table files (see "
+                        "--save-table) to the counts of the reads, the tables "
+                        "being checked against -k and --canonical")
+    parser.add_argument('--subtract', dest='subtract_tables', nargs='+',
+                        help="Remove the k-mers of these table files (e.g. "
+                        "host or contaminant k-mers) before building the "
+                        "graph")
+    parser.add_argument('-o', dest='output_file', type=str,
+                        default=os.curdir + os.sep + "contigs.fasta",
+                        help="Output contigs in fasta file (default contigs.fasta)")
+    parser.add_argument('-f', dest='graphimg_file', type=str,
+                        help="Save graph as an image (png)")
+    args = parser.parse_args()
+    if args.fastq_file is None:
+        if (not args.merge_tables or args.kmer_sizes or args.benchmark
+                or args.presize or args.estimate_only or args.table_file):
+            parser.error("the following arguments are required: -i")
+        if args.approximate is not None:
+            parser.error("--approximate counts reads, it requires -i")
+        return args
+    try:
+        args.fastq_file = expand_inputs(args.fastq_file)
+    except argparse.ArgumentTypeError as error:
+        parser.error(str(error))
+    return args
+
+
+BLOCK_SIZE = 4 * 1024 * 1024
+QUEUE_SIZE = 4
+# Magic bytes of the supported compression formats
+COMPRESSED_FORMATS = ((b"\x1f\x8b", gzip.open),
+                      (b"BZh", bz2.open),
+                      (b"\xfd7zXZ\x00", lzma.open))
+_END_OF_QUEUE = object()
+# 2-bit codes of the bases, 4 for any other character
+_BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for _code, _base in enumerate(b"ACGT"):
+    _BASE_CODES[_base] = _BASE_CODES[_base + 32] = _code
+_BASES = np.frombuffer(b"ACGT", dtype=np.uint8)
+_CODE_OF = _BASE_CODES.tolist()
+_MASK64 = (1 << 64) - 1
+# Masks swapping groups of 2, 4, 8, 16 and 32 bits of a 64-bit word
+_SWAP_MASKS = (0x3333333333333333, 0x0F0F0F0F0F0F0F0F, 0x00FF00FF00FF00FF,
+               0x0000FFFF0000FFFF, 0x00000000FFFFFFFF)
+_COMPLEMENT = str.maketrans("ACGTacgt", "TGCAtgca")
+CACHE_VERSION = 1
+
+
+def get_decompressor(magic):
+    """Identify the compression format of a file from its first bytes.
+
+    :param magic: (bytes) First bytes of the file.
+    :return: The function opening the compressed data, None for plain files.
+    """
+    for prefix, decompressor in COMPRESSED_FORMATS:
+        if magic.startswith(prefix):
+            return decompressor
+    return None
+
+
+@contextlib.contextmanager
+def open_reads(fastq_file):
+    """Open a read file in binary mode, decompressing it if needed.
+
+    :param fastq_file: (str) Path to a plain, gzip, bzip2 or xz file, "-"
+                       reads the standard input.
+    :return: A context manager giving a binary file object on the
+             uncompressed data and True if the data is compressed.
+    """
+    if fastq_file == "-":
+        handle = sys.stdin.buffer
+    else:
+        handle = open(fastq_file, 'rb')
+    try:
+        decompressor = get_decompressor(handle.peek(6)[:6])
+        if decompressor is None:
+            yield handle, False
+        else:
+            with decompressor(handle, 'rb') as filin:
+                yield filin, True
+    finally:
+        if fastq_file != "-":
+            handle.close()
+
+
+def detect_format(handle):
+    """Identify the format of a read stream from its first bytes.
+
+    :param handle: (file) Binary file object supporting peek.
+    :return: (str) "fasta" or "fastq".
+    """
+    if handle.peek(64).lstrip()[:1] == b">":
+        return "fasta"
+    return "fastq"
+
+
+def is_plain_fastq(fastq_file):
+    """Check if a read source is an uncompressed fastq file that can be mapped.
+
+    :param fastq_file: (str) Path to the read file, "-" for standard input.
+    :return: (boolean) True if the file is an uncompressed fastq file
+    """
+    if fastq_file == "-":
+        return False
+    with open(fastq_file, 'rb') as filin:
+        return (get_decompressor(filin.peek(6)[:6]) is None
+                and detect_format(filin) == "fastq")
+
+
+def expand_inputs(patterns):
+    """Expand the read sources given on the command line.
+
+    :param patterns: (list) Paths, glob patterns or "-" for standard input.
+    :raises ArgumentTypeError: If a file or a pattern matches nothing
+    :return: (list) Paths of the read files in the given order.
+    """
+    fastq_files = []
+    for pattern in patterns:
+        if pattern == "-":
+            fastq_files.append(pattern)
+        elif glob.has_magic(pattern):
+            matches = sorted(path for path in glob.glob(pattern)
+                             if os.path.isfile(path))
+            if not matches:
+                raise argparse.ArgumentTypeError(
+                    "{0} does not match any file.".format(pattern))
+            fastq_files.extend(matches)
+        else:
+            fastq_files.append(isfile(pattern))
+    return fastq_files
+
+
+def iter_in_thread(iterable, queue_size=QUEUE_SIZE):
+    """Consume an iterable in a background thread.
+
+    The items are produced ahead by the thread into a bounded queue, which
+    overlaps work releasing the GIL (I/O, decompression) with the consumer.
+
+    :param iterable: An iterable object, typically a block generator.
+    :param queue_size: (int) Maximum number of items waiting in the queue.
+    :return: A generator object that iterate the items of the iterable.
+    """
+    items = queue.Queue(queue_size)
+    stop = threading.Event()
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                items.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except Exception as error: # pylint: disable=broad-except
+            put((_END_OF_QUEUE, error))
+        else:
+            put((_END_OF_QUEUE, None))
+        finally:
+            if hasattr(iterable, "close"):
+                iterable.close()
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is _END_OF_QUEUE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        producer.join()
+
+
+def iter_fastq_blocks(handle, block_size=BLOCK_SIZE):
+    """Parse a binary fastq stream block by block.
+
+    Large blocks are read at once and cut into lines with bytes operations:
+    only complete 4-line records are returned and quality lines are never
+    decoded.
+
+    :param handle: (file) Binary file object opened on fastq data.
+    :param block_size: (int) Number of bytes read at once.
+    :raises ValueError: If the data does not follow the 4-line fastq layout.
+    :return: A generator object that iterate (sequences, qualities) tuples of
+             two lists of bytes, one tuple per block.
+    """
+    remainder = b""
+    eof = False
+    while not eof:
+        block = handle.read(block_size)
+        if not block:
+            eof = True
+            if not remainder.strip():
+                break
+            # Flush the last record(s), the file may lack a final newline
+            block = remainder + b"\n"
+        elif remainder:
+            block = remainder + block
+        end = block.rfind(b"\n") + 1
+        lines = block[:end].split(b"\n")
+        lines.pop()
+        if eof:
+            while lines and not lines[-1].strip():
+                lines.pop()
+        nb_lines = len(lines) - len(lines) % 4
+        if nb_lines < len(lines):
+            if eof:
+                raise ValueError("Truncated fastq record at the end of the file")
+            remainder = b"\n".join(lines[nb_lines:]) + b"\n" + block[end:]
+            del lines[nb_lines:]
+        else:
+            remainder = block[end:]
+        if not lines:
+            continue
+        if not lines[0].startswith(b"@"):
+            raise ValueError("Invalid fastq record: {0!r}".format(lines[0][:50]))
+        sequences = lines[1::4]
+        qualities = lines[3::4]
+        if b"\r" in block:
+            sequences = [seq.rstrip(b"\r") for seq in sequences]
+            qualities = [qual.rstrip(b"\r") for qual in qualities]
+        yield sequences, qualities
+
+
+def iter_read_blocks(fastq_file, block_size=BLOCK_SIZE):
+    """Parse read files block by block, decompressing them if needed.
+
+    Fastq and fasta data are told apart from their first byte. Compressed
+    files are decompressed and parsed by a background thread so that
+    decompression overlaps with the processing of the reads.
+
+    :param fastq_file: (str) Path to the fastq file, "-" for standard input,
+                       or a list of them streamed one after the other.
+    :param block_size: (int) Number of bytes read at once.
+    :return: A generator object that iterate (sequences, qualities) tuples,
+             qualities is None for fasta data.
+    """
+    if not isinstance(fastq_file, str):
+        for path in fastq_file:
+            yield from iter_read_blocks(path, block_size)
+        return
+    with open_reads(fastq_file) as (filin, compressed):
+        if detect_format(filin) == "fasta":
+            blocks = iter_fasta_blocks(filin, block_size)
+        else:
+            blocks = iter_fastq_blocks(filin, block_size)
+        if compressed:
+            blocks = iter_in_thread(blocks)
+        yield from blocks
+
+
+def _parse_fasta(data):
+    """Extract the sequences of complete fasta records.
+
+    :param data: (bytes) Fasta records, the first one starting with '>'.
+    :return: (list) Sequences as bytes, lines of a record being joined.
+    """
+    if not data.lstrip()[:1] == b">":
+        raise ValueError("Invalid fasta record: {0!r}".format(data[:50]))
+    sequences = []
+    for record in data.split(b"\n>"):
+        sequence = record.partition(b"\n")[2].replace(b"\n", b"")
+        if sequence:
+            sequences.append(sequence)
+    if b"\r" in data:
+        sequences = [seq.replace(b"\r", b"") for seq in sequences]
+    return sequences
+
+
+def iter_fasta_blocks(handle, block_size=BLOCK_SIZE):
+    """Parse a binary fasta stream block by block.
+
+    Records may span several lines and several blocks, each block is cut
+    on the last record start it holds and the records before are parsed at
+    once with bytes operations.
+
+    :param handle: (file) Binary file object opened on fasta data.
+    :param block_size: (int) Number of bytes read at once.
+    :raises ValueError: If the data does not start with a fasta header.
+    :return: A generator object that iterate (sequences, None) tuples, one
+             tuple per block.
+    """
+    pending = []
+    last_byte = b""
+    while True:
+        block = handle.read(block_size)
+        if not block:
+            data = b"".join(pending)
+            if data.strip():
+                yield _parse_fasta(data), None
+            break
+        start = (last_byte + block).rfind(b"\n>") + 1 - len(last_byte)
+        if start <= 0 and not (start == 0 and last_byte):
+            pending.append(block)
+            last_byte = block[-1:]
+            continue
+        data = b"".join(pending) + block[:start]
+        pending = [block[start:]]
+        last_byte = block[-1:]
+        if data.strip():
+            yield _parse_fasta(data), None
+
+
+def find_record_start(data, position):
+    """Find the first fastq record starting at or after a position.
+
+    A quality line may also start with '@', so a candidate header is only
+    accepted when the line two lines below is the '+' separator.
+
+    :param data: (bytes) Fastq data, may be a mmap object.
+    :param position: (int) Offset where the search starts.
+    :return: (int) Offset of the record, len(data) if there is none.
+    """
+    if position <= 0:
+        return 0
+    start = data.find(b"\n", position - 1) + 1
+    while 0 < start < len(data):
+        if data[start:start + 1] == b"@":
+            separator = data.find(b"\n", data.find(b"\n", start) + 1) + 1
+            if separator == 0:
+                break
+            if data[separator:separator + 1] == b"+":
+                return start
+        start = data.find(b"\n", start) + 1
+    return len(data)
+
+
+def index_fastq(fastq_file, persist=False):
+    """Build the index of the record start offsets of a fastq file.
+
+    The file is memory mapped and scanned by blocks for newlines, every
+    fourth line starting a record. A persisted index (fastq_file + ".fqi")
+    is reused as long as it is more recent than the fastq file.
+
+    :param fastq_file: (str) Path to an uncompressed fastq file.
+    :param persist: (boolean) True->Save the index next to the fastq file
+    :return: (np.ndarray) Sorted uint64 array of record offsets.
+    """
+    index_file = fastq_file + ".fqi"
+    if (os.path.isfile(index_file)
+            and os.path.getmtime(index_file) >= os.path.getmtime(fastq_file)):
+        with open(index_file, 'rb') as filin:
+            return np.load(filin)
+    offsets = []
+    if os.path.getsize(fastq_file) > 0:
+        with open(fastq_file, 'rb') as filin, \
+                mmap.mmap(filin.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            buffer = np.frombuffer(data, dtype=np.uint8)
+            nb_lines = 0
+            for start in range(0, len(buffer), BLOCK_SIZE):
+                newlines = np.flatnonzero(
+                    buffer[start:start + BLOCK_SIZE] == ord("\n")) + start
+                # Lines following the newlines numbered 4n+3 start records
+                first = (3 - nb_lines) % 4
+                offsets.append(newlines[first::4] + 1)
+                nb_lines += len(newlines)
+            del buffer
+            offsets = [np.array([0], dtype=np.int64)] + offsets
+            offsets = np.concatenate(offsets)
+            if offsets[-1] >= len(data) or not data[offsets[-1]:].strip():
+                offsets = offsets[:-1]
+    index = np.asarray(offsets, dtype=np.uint64)
+    if persist:
+        with open(index_file, 'wb') as filout:
+            np.save(filout, index)
+    return index
+
+
+def split_fastq(fastq_file, nb_chunks, index=None):
+    """Split an uncompressed fastq file into disjoint byte ranges.
+
+    :param fastq_file: (str) Path to an uncompressed fastq file.
+    :param nb_chunks: (int) Number of ranges wanted.
+    :param index: (np.ndarray) Record offsets from index_fastq, when given
+                  the ranges hold the same number of records.
+    :return: (list) A list of (start, end) offsets, each on record bounds.
+    """
+    size = os.path.getsize(fastq_file)
+    if size == 0:
+        # An empty file can not be mapped
+        return []
+    if index is not None:
+        if len(index) == 0:
+            return []
+        cuts = [int(index[len(index) * i // nb_chunks]) for i in range(nb_chunks)]
+    else:
+        with open(fastq_file, 'rb') as filin, \
+                mmap.mmap(filin.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            cuts = [find_record_start(data, size * i // nb_chunks)
+                    for i in range(nb_chunks)]
+    cuts.append(size)
+    return [(start, end) for start, end in zip(cuts, cuts[1:]) if start < end]
+
+
+class _RangeReader:
+    """Read-only file-like view on a byte range of a buffer."""
+
+    def __init__(self, data, start, end):
+        self.data = data
+        self.position = start
+        self.end = end
+
+    def read(self, size):
+        """Read at most size bytes, without crossing the end of the range."""
+        chunk = self.data[self.position:min(self.position + size, self.end)]
+        self.position += len(chunk)
+        return chunk
+
+
+def read_fastq_range(fastq_file, start, end, block_size=BLOCK_SIZE):
+    """Parse the fastq records of a byte range of a memory mapped file.
+
+    :param fastq_file: (str) Path to an uncompressed fastq file.
+    :param start: (int) Offset of the first record of the range.
+    :param end: (int) Offset where the range stops, on a record bound.
+    :param block_size: (int) Number of bytes parsed at once.
+    :return: A generator object that iterate (sequences, qualities) tuples.
+    """
+    with open(fastq_file, 'rb') as filin, \
+            mmap.mmap(filin.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        yield from iter_fastq_blocks(_RangeReader(data, start, end), block_size)
+
+
+def _encode_bases(sequences):
+    """Convert sequences into one array of 2-bit base codes.
+
+    Sequences are split at the characters other than A, C, G and T, which
+    does not change the set of kmers they hold.
+
+    :param sequences: (list) Sequences as bytes.
+    :return: (np.ndarray, np.ndarray) The uint8 codes of the bases and the
+             uint64 lengths of the segments they make.
+    """
+    codes = _BASE_CODES[np.frombuffer(b"N".join(sequences), dtype=np.uint8)]
+    valid = codes < 4
+    edges = np.diff(np.concatenate(([0], valid, [0])).astype(np.int8))
+    lengths = np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)
+    return codes[valid], lengths.astype(np.uint64)
+
+
+def _pack_bases(codes):
+    """Pack 2-bit base codes four per byte, the first base in the high bits.
+
+    :param codes: (np.ndarray) uint8 codes, their number is a multiple of 4.
+    :return: (np.ndarray) uint8 packed bases.
+    """
+    quads = codes.reshape(-1, 4)
+    return quads[:, 0] << 6 | quads[:, 1] << 4 | quads[:, 2] << 2 | quads[:, 3]
+
+
+def _unpack_bases(packed, start, end):
+    """Unpack the 2-bit codes of the bases between two base offsets.
+
+    :param packed: (np.ndarray) uint8 packed bases, may be a memmap.
+    :param start: (int) Offset of the first base.
+    :param end: (int) Offset following the last base.
+    :return: (np.ndarray) uint8 codes of the bases.
+    """
+    chunk = np.asarray(packed[start // 4:(end + 3) // 4])
+    codes = np.empty((len(chunk), 4), dtype=np.uint8)
+    for position in range(4):
+        codes[:, position] = (chunk >> (6 - 2 * position)) & 3
+    return codes.ravel()[start % 4:start % 4 + end - start]
+
+
+def read_cache_prefix(fastq_file, cache_dir):
+    """Compute the path of the read cache of a set of read files.
+
+    :param fastq_file: (list) Paths to the read files.
+    :param cache_dir: (str) Directory holding the caches.
+    :return: (str) Path prefix of the cache files, named after the hash of
+             the content of the read files.
+    """
+    digest = hashlib.blake2b(str(CACHE_VERSION).encode(), digest_size=16)
+    for path in fastq_file:
+        with open(path, 'rb') as filin:
+            while True:
+                chunk = filin.read(BLOCK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+    return os.path.join(cache_dir, digest.hexdigest())
+
+
+def write_read_cache(blocks, cache_prefix):
+    """Store reads as packed 2-bit bases while streaming them.
+
+    The bases go to cache_prefix + ".2bit", four per byte, and the offsets
+    of the reads (in bases) to cache_prefix + ".idx". The files are renamed
+    once complete so that an interrupted run leaves no partial cache.
+
+    :param blocks: An iterable object of (sequences, qualities) blocks.
+    :param cache_prefix: (str) Path prefix of the cache files.
+    :return: A generator object that iterate (sequences, None) tuples of the
+             reads as stored in the cache.
+    """
+    lengths = [np.zeros(1, dtype=np.uint64)]
+    carry = np.empty(0, dtype=np.uint8)
+    with open(cache_prefix + ".2bit.tmp", 'wb') as filout:
+        for sequences, _ in blocks:
+            codes, segment_lengths = _encode_bases(sequences)
+            lengths.append(segment_lengths)
+            bases = _BASES[codes].tobytes()
+            bounds = [0] + np.cumsum(segment_lengths).tolist()
+            codes = np.concatenate((carry, codes))
+            nb_codes = len(codes) - len(codes) % 4
+            filout.write(_pack_bases(codes[:nb_codes]).tobytes())
+            carry = codes[nb_codes:]
+            yield [bases[begin:end] for begin, end in zip(bounds, bounds[1:])], None
+        if len(carry) > 0:
+            padding = np.zeros(4 - len(carry), dtype=np.uint8)
+            filout.write(_pack_bases(np.concatenate((carry, padding))).tobytes())
+    with open(cache_prefix + ".idx.tmp", 'wb') as filout:
+        np.save(filout, np.cumsum(np.concatenate(lengths), dtype=np.uint64))
+    os.replace(cache_prefix + ".2bit.tmp", cache_prefix + ".2bit")
+    os.replace(cache_prefix + ".idx.tmp", cache_prefix + ".idx")
+
+
+def iter_read_cache(cache_prefix, block_size=BLOCK_SIZE):
+    """Read back the reads of a cache written by write_read_cache.
+
+    :param cache_prefix: (str) Path prefix of the cache files.
+    :param block_size: (int) Approximate number of bases per block.
+    :return: A generator object that iterate (sequences, None) tuples.
+    """
+    with open(cache_prefix + ".idx", 'rb') as filin:
+        offsets = np.load(filin)
+    if offsets[-1] == 0:
+        return
+    packed = np.memmap(cache_prefix + ".2bit", dtype=np.uint8, mode='r')
+    first = 0
+    while first < len(offsets) - 1:
+        last = np.searchsorted(offsets, offsets[first] + block_size, 'right') - 1
+        last = min(max(last, first + 1), len(offsets) - 1)
+        start = int(offsets[first])
+        bases = _BASES[_unpack_bases(packed, start, int(offsets[last]))].tobytes()
+        bounds = (offsets[first:last + 1] - start).tolist()
+        yield [bases[begin:end] for begin, end in zip(bounds, bounds[1:])], None
+        first = last
+
+
+def _split_read(sequence, quality, min_length):
+    """Split a read at its N bases, keeping the long enough segments.
+
+    :param sequence: (bytes) Sequence of the read.
+    :param quality: (bytes) Quality line of the read, may be None.
+    :param min_length: (int) Minimum length of the segments kept.
+    :return: (list) A list of (sequence, quality) segments.
+    """
+    segments = []
+    start = 0
+    for segment in sequence.split(b"N"):
+        end = start + len(segment)
+        if len(segment) >= max(min_length, 1):
+            segments.append((segment, quality[start:end] if quality else None))
+        start = end + 1
+    return segments
+
+
+def trim_read_blocks(blocks, min_quality=0, window=4, min_length=0,
+                     phred_offset=33):
+    """Trim and filter reads before they are cut into kmers.
+
+    Each read is cut at the first window of bases whose mean Phred quality
+    is below min_quality, then split at its N bases, and the parts shorter
+    than min_length are dropped. A read shorter than the window is taken as
+    a single window, dropped whole when its mean quality is below
+    min_quality. Window qualities are computed for a whole block at once on
+    the raw quality lines. Fasta reads have no quality and are only split
+    and filtered.
+
+    :param blocks: An iterable object of (sequences, qualities) blocks.
+    :param min_quality: (int) Minimum mean quality of a window, 0 disables
+                        the quality trimming.
+    :param window: (int) Number of bases of the sliding window, 1 at least.
+    :param min_length: (int) Minimum length of the reads kept.
+    :param phred_offset: (int) Offset of the quality encoding.
+    :raises ValueError: If the window is empty
+    :return: A generator object that iterate (sequences, qualities) tuples.
+    """
+    if window < 1:
+        raise ValueError("The trimming window must hold at least one base.")
+    for sequences, qualities in blocks:
+        if qualities is not None and min_quality > 0 and sequences:
+            lengths = np.fromiter(map(len, qualities), dtype=np.int64,
+                                  count=len(qualities))
+            starts = np.cumsum(lengths) - lengths
+            scores = np.frombuffer(b"".join(qualities), dtype=np.uint8)
+            sums = np.concatenate(([0], np.cumsum(scores, dtype=np.int64)))
+            window_sums = sums[window:] - sums[:-window]
+            failing = np.flatnonzero(
+                window_sums < (min_quality + phred_offset) * window)
+            # First failing window starting in each read, if it fits the read
+            first = np.searchsorted(failing, starts)
+            cuts = np.append(failing, len(scores))[first]
+            keep = np.where(cuts + window <= starts + lengths, cuts - starts,
+                            lengths)
+            # Reads shorter than the window are a single window
+            short = lengths < window
+            keep[short & (sums[starts + lengths] - sums[starts]
+                          < (min_quality + phred_offset) * lengths)] = 0
+            keep = keep.tolist()
+            sequences = [seq[:size] for seq, size in zip(sequences, keep)]
+            qualities = [qual[:size] for qual, size in zip(qualities, keep)]
+        kept = []
+        kept_qualities = []
+        for index, sequence in enumerate(sequences):
+            quality = qualities[index] if qualities is not None else None
+            if b"N" in sequence:
+                for segment, segment_quality in _split_read(sequence, quality,
+                                                            min_length):
+                    kept.append(segment)
+                    kept_qualities.append(segment_quality)
+            elif len(sequence) >= max(min_length, 1):
+                kept.append(sequence)
+                kept_qualities.append(quality)
+        yield kept, (kept_qualities if qualities is not None else None)
+
+
+def _mix64(values):
+    """Scramble 64-bit integers (splitmix64 finalizer).
+
+    :param values: (np.ndarray) uint64 values.
+    :return: (np.ndarray) uint64 hashes.
+    """
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xbf58476d1ce4e5b9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94d049bb133111eb)
+    return values ^ (values >> np.uint64(31))
+
+
+def _hash_codes(codes):
+    """Hash the codes of kmers to 64-bit values.
+
+    :param codes: (np.ndarray) uint64 codes of the kmers, or rows of uint64
+                  words for kmers longer than 32 bases (see
+                  encode_read_block).
+    :return: (np.ndarray) uint64 hashes, one per kmer.
+    """
+    if codes.ndim == 1:
+        return _mix64(codes)
+    hashes = _mix64(codes[:, 0])
+    for word in range(1, codes.shape[1]):
+        hashes = _mix64(hashes ^ codes[:, word])
+    return hashes
+
+
+def _sketch_keys(codes):
+    """Compute 64-bit keys of kmer codes, for sketches and filters.
+
+    :param codes: (np.ndarray) Codes of the kmers (see encode_read_block).
+    :return: (np.ndarray) The uint64 codes themselves up to 32 bases, hashes
+             of their words beyond.
+    """
+    return codes if codes.ndim == 1 else _hash_codes(codes)
+
+
+class CountMinSketch:
+    """Count-Min sketch of integer keys in a fixed amount of memory.
+
+    The counts of the keys are spread on depth rows of width counters, a
+    key being counted once per row; the estimate of a key is the smallest
+    of its counters, which never underestimates its true count.
+    """
+
+    def __init__(self, width, depth=4):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.uint32)
+        self.seeds = _mix64(np.arange(1, depth + 1, dtype=np.uint64))
+        self.total = 0
+
+    def counters(self, keys):
+        """Compute the counter of each key in each row.
+
+        :param keys: (np.ndarray) uint64 keys.
+        :return: (np.ndarray) Index of the counter of each key (columns) in
+                 each row (rows) of the flattened table.
+        """
+        keys = np.asarray(keys, dtype=np.uint64)
+        columns = (_mix64(keys[np.newaxis, :] ^ self.seeds[:, np.newaxis])
+                   % np.uint64(self.width)).astype(np.intp)
+        return columns + np.arange(self.depth)[:, np.newaxis] * self.width
+
+    def add(self, keys, counts=None, conservative=False):
+        """Count occurrences of keys.
+
+        With the conservative update, a counter is only raised up to the
+        new estimate of the key, which limits the overestimation of the
+        keys sharing counters with frequent ones.
+
+        :param keys: (np.ndarray) uint64 keys, unique for the conservative
+                     update.
+        :param counts: (np.ndarray) Occurrences of each key, one by default.
+        :param conservative: (boolean) True->Use the conservative update
+        """
+        self.add_counters(self.counters(keys), counts, conservative)
+
+    def add_counters(self, counters, counts=None, conservative=False):
+        """Count occurrences of keys from their counters (see add).
+
+        :param counters: (np.ndarray) Counters of the keys (see counters).
+        :param counts: (np.ndarray) Occurrences of each key, one by default.
+        :param conservative: (boolean) True->Use the conservative update
+        """
+        if counts is None:
+            counts = np.ones(counters.shape[1], dtype=np.uint32)
+        counts = np.asarray(counts, dtype=np.uint32)
+        self.total += int(counts.sum())
+        table = self.table.reshape(-1)
+        if conservative:
+            estimates = table[counters].min(axis=0) + counts
+            np.maximum.at(table, counters.ravel(), np.tile(estimates,
+                                                           self.depth))
+        elif counters.shape[1] > self.width // 4:
+            # A large batch is cheaper to count over the whole table
+            self.table += self.counter_totals(counters, counts).astype(
+                np.uint32)
+        else:
+            np.add.at(table, counters.ravel(), np.tile(counts, self.depth))
+
+    def counter_totals(self, counters, counts=None):
+        """Count keys per counter, without adding them to the sketch.
+
+        :param counters: (np.ndarray) Counters of the keys (see counters).
+        :param counts: (np.ndarray) Occurrences of each key, one by default.
+        :return: (np.ndarray) int64 counts of the keys of each counter, of
+                 the shape of the table.
+        """
+        weights = None if counts is None else np.tile(counts, self.depth)
+        return np.bincount(counters.ravel(), weights, self.table.size
+                           ).astype(np.int64).reshape(self.table.shape)
+
+    def error_bound(self):
+        """Bound the overestimation of the counts.
+
+        :return: (float, float) With probability 1 - delta, an estimate
+                 exceeds the true count by at most epsilon * total, where
+                 epsilon = e / width and delta = exp(-depth); returns
+                 (epsilon * total, delta).
+        """
+        return math.e / self.width * self.total, math.exp(-self.depth)
+
+    def query(self, keys):
+        """Estimate the counts of keys.
+
+        :param keys: (np.ndarray) uint64 keys.
+        :return: (np.ndarray) uint32 estimated counts.
+        """
+        return self.query_counters(self.counters(keys))
+
+    def query_counters(self, counters):
+        """Estimate the counts of keys from their counters (see query).
+
+        :param counters: (np.ndarray) Counters of the keys (see counters).
+        :return: (np.ndarray) uint32 estimated counts.
+        """
+        return self.table.reshape(-1)[counters].min(axis=0)
+
+
+def _bit_length(values):
+    """Compute the bit lengths of 64-bit integers by binary steps.
+
+    :param values: (np.ndarray) uint64 values.
+    :return: (np.ndarray) uint8 number of bits of each value, 0 for 0.
+    """
+    lengths = np.zeros(len(values), dtype=np.uint64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        # Shift the values that have bits above the step by the step
+        step = ((values >> np.uint64(shift)) != 0).astype(np.uint64)
+        step *= np.uint64(shift)
+        values = values >> step
+        lengths += step
+    # The remaining values are 0 or 1
+    return (lengths + values).astype(np.uint8)
+
+
+class HyperLogLog:
+    """HyperLogLog estimate of the number of distinct integer keys.
+
+    The first bits of the hash of a key pick one of 2**precision registers,
+    which keeps the largest rank (position of the first 1 bit) of the other
+    bits; the harmonic mean of the registers gives the estimate, with a
+    relative standard error of 1.04 / sqrt(2**precision).
+    """
+
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add(self, keys):
+        """Add keys to the estimate.
+
+        :param keys: (np.ndarray) uint64 keys.
+        """
+        hashes = _mix64(np.asarray(keys, dtype=np.uint64))
+        index = (hashes >> np.uint64(64 - self.precision)).astype(np.intp)
+        rest = hashes & np.uint64((1 << 64 - self.precision) - 1)
+        ranks = (64 - self.precision + 1) - _bit_length(rest)
+        np.maximum.at(self.registers, index, ranks)
+
+    def estimate(self):
+        """Estimate the number of distinct keys added.
+
+        :return: (int) Estimated number of distinct keys, from linear
+                 counting of the empty registers for small numbers.
+        """
+        nb_registers = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / nb_registers)
+        raw = (alpha * nb_registers ** 2
+               / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64))))
+        nb_empty = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * nb_registers and nb_empty:
+            return round(nb_registers * math.log(nb_registers / nb_empty))
+        return round(raw)
+
+
+def _block_kmer_keys(sequences, kmer_size):
+    """Compute 64-bit keys of the kmers of a block of reads, for sketches.
+
+    :param sequences: (list) Sequences of the reads as bytes.
+    :param kmer_size: (int) Size of the kmers.
+    :return: (np.ndarray, np.ndarray) uint64 keys of the kmers (see
+             _sketch_keys) and the start of the keys of each read (one more
+             for the end of the block).
+    """
+    bases = _BASE_CODES[np.frombuffer(b"N".join(sequences), dtype=np.uint8)]
+    starts = np.cumsum([0] + [len(sequence) + 1 for sequence in sequences])
+    if len(bases) < kmer_size:
+        return np.empty(0, dtype=np.uint64), np.zeros(len(starts), np.intp)
+    # Position of the kmers kept by _encode_kmers, free of other bases
+    invalid = np.concatenate(([0], np.cumsum(bases > 3)))
+    positions = np.flatnonzero(invalid[kmer_size:] == invalid[:-kmer_size])
+    keys = _sketch_keys(_encode_kmers(bases, kmer_size))
+    return keys, np.searchsorted(positions, starts)
+
+
+def _segment_medians(values, bounds):
+    """Compute the median of consecutive segments of an array.
+
+    :param values: (np.ndarray) The values.
+    :param bounds: (np.ndarray) Start of each segment, one more for the end
+                   of the last one.
+    :return: (np.ndarray) Median of each segment, infinite when empty.
+    """
+    sizes = np.diff(bounds)
+    segments = np.repeat(np.arange(len(sizes), dtype=np.int64), sizes)
+    scale = int(values.max(initial=0)) + 1
+    ordered = (np.sort(segments * scale + values) % scale).astype(np.float64)
+    medians = np.full(len(sizes), np.inf)
+    filled = sizes > 0
+    starts = bounds[:-1][filled]
+    medians[filled] = (ordered[starts + (sizes[filled] - 1) // 2]
+                       + ordered[starts + sizes[filled] // 2]) / 2
+    return medians
+
+
+class BloomFilter:
+    """Bloom filter of integer keys.
+
+    The filter is sized for an expected number of keys and a false positive
+    rate; a key sets nb_hashes bits chosen by double hashing.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.nb_bits = max(64, int(-capacity * math.log(error_rate)
+                                   / math.log(2) ** 2))
+        self.nb_hashes = max(1, round(self.nb_bits / capacity * math.log(2)))
+        self.bits = np.zeros((self.nb_bits + 7) // 8, dtype=np.uint8)
+
+    def _positions(self, keys):
+        """Compute the bits of each key, one row per hash function."""
+        keys = np.asarray(keys, dtype=np.uint64)
+        first = _mix64(keys)
+        second = _mix64(keys ^ np.uint64(0x9e3779b97f4a7c15)) | np.uint64(1)
+        steps = np.arange(self.nb_hashes, dtype=np.uint64)[:, np.newaxis]
+        return (first + steps * second) % np.uint64(self.nb_bits)
+
+    def add(self, keys):
+        """Add unique keys to the filter.
+
+        :param keys: (np.ndarray) uint64 keys, without duplicates.
+        :return: (np.ndarray) True for the keys that seemed already present.
+        """
+        positions = self._positions(keys)
+        bytes_index = (positions >> np.uint64(3)).astype(np.intp)
+        bit_masks = (np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8))
+        present = ((self.bits[bytes_index] & bit_masks) != 0).all(axis=0)
+        np.bitwise_or.at(self.bits, bytes_index.ravel(), bit_masks.ravel())
+        return present
+
+
+def normalize_read_blocks(blocks, kmer_size, coverage=20, width=1 << 22,
+                          depth=4):
+    """Drop the reads of regions already sequenced at the target coverage.
+
+    Digital normalization: the median abundance of the kmers of a read is
+    estimated from the kmers of the reads kept so far, counted in a
+    Count-Min sketch of bounded memory, and the read is dropped when it
+    reaches the target coverage.
+
+    The kmers of a block are encoded and hashed at once. As the estimates
+    only grow, the reads reaching the coverage at the start of the block
+    are dropped at once. The estimates of the other reads are bounded as if
+    all of them were kept: the reads staying under the coverage are kept at
+    once, only the remaining ones being checked one after the other.
+
+    :param blocks: An iterable object of (sequences, qualities) blocks.
+    :param kmer_size: (int) Size of the kmers.
+    :param coverage: (int) Target median kmer coverage of the reads.
+    :param width: (int) Number of counters of each row of the sketch.
+    :param depth: (int) Number of rows of the sketch.
+    :return: A generator object that iterate (sequences, qualities) tuples.
+    """
+    sketch = CountMinSketch(width, depth)
+    for sequences, qualities in blocks:
+        keys, bounds = _block_kmer_keys(sequences, kmer_size)
+        counters = sketch.counters(keys)
+        sizes = np.diff(bounds)
+        medians = _segment_medians(sketch.query_counters(counters), bounds)
+        # Estimates once every read under the coverage is counted
+        upper = (sketch.table + sketch.counter_totals(
+            counters[:, np.repeat(medians < coverage, sizes)])).reshape(-1)
+        sure = _segment_medians(upper[counters].min(axis=0),
+                                bounds) < coverage
+        sure_kmers = np.repeat(sure, sizes)
+        kept = sure.copy()
+        start = 0
+        for index in np.flatnonzero((medians < coverage) & ~sure).tolist():
+            # Count the reads kept for sure since the last check
+            sketch.add_counters(counters[:, start:bounds[index]][
+                :, sure_kmers[start:bounds[index]]])
+            start = bounds[index + 1]
+            read_counters = counters[:, bounds[index]:start]
+            estimates = np.sort(sketch.query_counters(read_counters))
+            middle = len(estimates) // 2
+            if estimates[middle] + estimates[-middle - 1] < 2 * coverage:
+                sketch.add_counters(read_counters)
+                kept[index] = True
+        sketch.add_counters(counters[:, start:][:, sure_kmers[start:]])
+        kept = np.flatnonzero(kept).tolist()
+        yield ([sequences[index] for index in kept],
+               None if qualities is None
+               else [qualities[index] for index in kept])
+
+
+def iter_cached_read_blocks(fastq_file, cache_dir, trimming=None):
+    """Parse read files, through a packed 2-bit cache.
+
+    The first run parses the files and writes the cache on the fly, later
+    runs over the same data read the memory mapped cache and skip parsing.
+    The cache stores the reads after trimming, its name depends on the
+    trimming parameters. The standard input cannot be hashed beforehand and
+    is never cached.
+
+    :param fastq_file: (str) Path to the fastq file, or a list of them.
+    :param cache_dir: (str) Directory holding the caches.
+    :param trimming: (dict) Parameters of trim_read_blocks, None to keep
+                     the reads as they are.
+    :return: A generator object that iterate (sequences, qualities) tuples,
+             qualities is None unless reading the standard input.
+    """
+    if isinstance(fastq_file, str):
+        fastq_file = [fastq_file]
+    if "-" in fastq_file:
+        yield from load_read_blocks(fastq_file, trimming=trimming)
+        return
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_prefix = read_cache_prefix(fastq_file, cache_dir)
+    if trimming is not None:
+        cache_prefix += "_" + hashlib.blake2b(
+            repr(sorted(trimming.items())).encode(), digest_size=4).hexdigest()
+    if os.path.isfile(cache_prefix + ".idx"):
+        yield from iter_read_cache(cache_prefix)
+    else:
+        yield from write_read_cache(load_read_blocks(fastq_file,
+                                                     trimming=trimming),
+                                    cache_prefix)
+
+
+def sample_read_blocks(blocks, nb_reads):
+    """Keep the first reads of blocks of reads.
+
+    :param blocks: An iterable object of (sequences, qualities) blocks.
+    :param nb_reads: (int) Number of reads kept.
+    :return: A generator object that iterate (sequences, qualities) tuples.
+    """
+    for sequences, qualities in blocks:
+        if nb_reads <= 0:
+            break
+        if len(sequences) > nb_reads:
+            sequences = sequences[:nb_reads]
+            if qualities is not None:
+                qualities = qualities[:nb_reads]
+        nb_reads -= len(sequences)
+        yield sequences, qualities
+
+
+def load_read_blocks(fastq_file, cache_dir=None, trimming=None):
+    """Stream the reads of read files block by block.
+
+    :param fastq_file: (str) Path to the fastq file, possibly compressed, "-"
+                       for standard input, or a list of them.
+    :param cache_dir: (str) Directory of the 2-bit read cache, reads are then
+                      split at the bases other than A, C, G and T.
+    :param trimming: (dict) Parameters of trim_read_blocks, None to keep
+                     the reads as they are.
+    :return: A generator object that iterate (sequences, qualities) tuples.
+    """
+    if cache_dir is not None:
+        return iter_cached_read_blocks(fastq_file, cache_dir, trimming)
+    blocks = iter_read_blocks(fastq_file)
+    if trimming is not None:
+        blocks = trim_read_blocks(blocks, **trimming)
+    return blocks
+
+
+def read_fastq(fastq_file, as_bytes=False, cache_dir=None, trimming=None):
+    """Extract reads from fastq (or fasta) files.
+
+    :param fastq_file: (str) Path to the fastq file, possibly compressed, "-"
+                       for standard input, or a list of them.
+    :param as_bytes: (boolean) True->Sequences are yielded as raw bytes
+    :param cache_dir: (str) Directory of the 2-bit read cache, reads are then
+                      split at the bases other than A, C, G and T.
+    :param trimming: (dict) Parameters of trim_read_blocks, None to keep
+                     the reads as they are.
+    :return: A generator object that iterate the read sequences. 
+    """
+    for sequences, _ in load_read_blocks(fastq_file, cache_dir, trimming):
+        if as_bytes:
+            yield from sequences
+        else:
+            for sequence in sequences:
+                yield sequence.decode("ascii")
+
+
+def cut_kmer(read, kmer_size):
+    """Cut read into kmers of size kmer_size.
+    
+    :param read: (str) Sequence of a read.
+    :return: A generator object that iterate the kmers of of size kmer_size.
+    """
+    for i in range(len(read) - kmer_size + 1):
+        kmer = read[i:i + kmer_size]
+        yield kmer   
+    pass
+
+
+def encode_kmer(kmer):
+    """Encode a kmer as an integer of 2 bits per base (A=0, C=1, G=2, T=3).
+
+    :param kmer: (str) Sequence of the kmer.
+    :raises ValueError: If the kmer holds a base other than A, C, G and T
+    :return: (int) Code of the kmer, the first base in the high bits.
+    """
+    code = 0
+    for base in kmer.encode("ascii") if isinstance(kmer, str) else kmer:
+        base_code = _CODE_OF[base]
+        if base_code > 3:
+            raise ValueError("Invalid base in kmer {0!r}".format(kmer))
+        code = code << 2 | base_code
+    return code
+
+
+def decode_kmer(code, kmer_size):
+    """Decode a kmer encoded by encode_kmer.
+
+    :param code: (int) Code of the kmer.
+    :param kmer_size: (int) Size of the kmer.
+    :return: (str) Sequence of the kmer.
+    """
+    return "".join("ACGT"[(code >> shift) & 3]
+                   for shift in range(2 * kmer_size - 2, -1, -2))
+
+
+def cut_kmer_codes(read, kmer_size):
+    """Cut read into kmers of size kmer_size encoded as integers.
+
+    The code is updated for each base with a shift and a mask instead of
+    slicing the read; kmers holding a base other than A, C, G and T are
+    skipped.
+
+    :param read: (str) Sequence of a read, or bytes.
+    :param kmer_size: (int) Size of the kmers.
+    :return: A generator object that iterate the codes of the kmers (see
+             encode_kmer).
+    """
+    if isinstance(read, str):
+        read = read.encode("ascii")
+    mask = (1 << 2 * kmer_size) - 1
+    code = 0
+    nb_valid = 0
+    for base in read:
+        base_code = _CODE_OF[base]
+        if base_code > 3:
+            nb_valid = 0
+            continue
+        code = (code << 2 | base_code) & mask
+        nb_valid += 1
+        if nb_valid >= kmer_size:
+            yield code
+
+
+def _reverse_bases64(words):
+    """Reverse the order of the 32 bases of 64-bit words of 2-bit codes.
+
+    :param words: (int) A 64-bit word, or a np.ndarray of uint64 words.
+    :return: The words with their bases in the reverse order.
+    """
+    if isinstance(words, np.ndarray):
+        masks = [np.uint64(mask) for mask in _SWAP_MASKS]
+        shifts = [np.uint64(shift) for shift in (2, 4, 8, 16, 32)]
+        for mask, shift in zip(masks, shifts):
+            words = ((words >> shift) & mask) | ((words & mask) << shift)
+        return words
+    for mask, shift in zip(_SWAP_MASKS, (2, 4, 8, 16, 32)):
+        words = ((words >> shift) & mask) | ((words & mask) << shift)
+    return words
+
+
+def reverse_complement_code(code, kmer_size):
+    """Compute the code of the reverse complement of an encoded kmer.
+
+    With A=0, C=1, G=2 and T=3 the complement of a base is 3 - code, that
+    is a xor with 3; the bases are then reversed by swapping groups of bits
+    in each 64-bit word (and the order of the words).
+
+    :param code: (int) Code of the kmer (see encode_kmer).
+    :param kmer_size: (int) Size of the kmer.
+    :return: (int) Code of the reverse complement of the kmer.
+    """
+    nb_words = (kmer_size + 31) // 32
+    code = (code ^ ((1 << 2 * kmer_size) - 1)) << 2 * (32 * nb_words - kmer_size)
+    reverse = 0
+    for word in range(nb_words):
+        reverse = reverse << 64 | _reverse_bases64((code >> 64 * word) & _MASK64)
+    return reverse
+
+
+def reverse_complement_codes(codes, kmer_size):
+    """Compute the reverse complements of encoded kmers.
+
+    Beyond 32 bases, the complemented words are reversed in both orders
+    (words and bases) and shifted back across words by the padding of the
+    first word.
+
+    :param codes: (np.ndarray) Codes of the kmers (see encode_read_block).
+    :param kmer_size: (int) Size of the kmers.
+    :return: (np.ndarray) Codes of their reverse complements.
+    """
+    if codes.ndim == 1:
+        complement = codes ^ np.uint64((1 << 2 * kmer_size) - 1)
+        return _reverse_bases64(complement) >> np.uint64(64 - 2 * kmer_size)
+    words = _reverse_bases64(codes[:, ::-1] ^ np.uint64(_MASK64))
+    padding = 2 * (32 * codes.shape[1] - kmer_size)
+    if padding:
+        shifted = words >> np.uint64(padding)
+        shifted[:, 1:] |= words[:, :-1] << np.uint64(64 - padding)
+        words = shifted
+    return words
+
+
+def canonical_codes(codes, kmer_size):
+    """Replace each encoded kmer by the smallest of it and its reverse
+    complement.
+
+    :param codes: (np.ndarray) Codes of the kmers (see encode_read_block).
+    :param kmer_size: (int) Size of the kmers.
+    :return: (np.ndarray) Canonical codes of the kmers.
+    """
+    twins = reverse_complement_codes(codes, kmer_size)
+    if codes.ndim == 1:
+        return np.minimum(codes, twins)
+    return np.where(_rows_less(twins, codes)[:, np.newaxis], twins, codes)
+
+
+def _rows_less(first, second):
+    """Compare kmer codes one to one.
+
+    :param first: (np.ndarray) Codes of kmers (see encode_read_block).
+    :param second: (np.ndarray) Codes of as many kmers.
+    :return: (np.ndarray) True where the first code is the smallest, rows
+             of words comparing on their first differing word.
+    """
+    if first.ndim == 1:
+        return first < second
+    column = (first != second).argmax(axis=1)
+    rows = np.arange(len(first))
+    return first[rows, column] < second[rows, column]
+
+
+def _split_code(code, nb_words):
+    """Split the integer code of a kmer into 64-bit words.
+
+    :param code: (int) Code of the kmer (see encode_kmer).
+    :param nb_words: (int) Number of words.
+    :return: (list) The words, the most significant first.
+    """
+    return [(int(code) >> 64 * word) & _MASK64
+            for word in range(nb_words - 1, -1, -1)]
+
+
+def reverse_complement(sequence):
+    """Compute the reverse complement of a sequence.
+
+    :param sequence: (str) A DNA sequence.
+    :return: (str) Its reverse complement.
+    """
+    return sequence.translate(_COMPLEMENT)[::-1]
+
+
+def _encode_windows(bases, window_size):
+    """Encode all the windows of an array of base codes (window_size <= 32).
+
+    The codes of the windows of 1, 2, 4... bases are combined with
+    vectorized shifts until the windows reach window_size bases.
+
+    :param bases: (np.ndarray) uint8 base codes.
+    :param window_size: (int) Size of the windows, 32 at most.
+    :return: (np.ndarray) uint64 codes of the windows, by start position.
+    """
+    window = bases.astype(np.uint64)
+    size = 1
+    codes = None
+    codes_size = 0
+    remaining = window_size
+    while True:
+        if remaining & 1:
+            if codes is None:
+                codes = window
+            else:
+                codes = (codes[:len(window) - codes_size]
+                         << np.uint64(2 * size)) | window[codes_size:]
+            codes_size += size
+        remaining >>= 1
+        if not remaining:
+            break
+        window = window[:-size] << np.uint64(2 * size) | window[size:]
+        size *= 2
+    return codes[:len(bases) - window_size + 1]
+
+
+def encode_read_block(sequences, kmer_size, canonical=False):
+    """Encode all the kmers of a block of reads at once.
+
+    The reads are joined into one array of 2-bit base codes whose windows
+    are encoded with vectorized shifts. Up to 32 bases, a kmer is one uint64
+    code; longer kmers are rows of uint64 words, the words of encode_kmer
+    from the most significant: the first word holds the first
+    kmer_size % 32 bases (or 32) and each other word 32 bases, so that rows
+    sort as the codes do.
+
+    :param sequences: (list) Sequences of the reads as bytes.
+    :param kmer_size: (int) Size of the kmers.
+    :param canonical: (boolean) True->Encode each kmer as the smallest of
+                      it and its reverse complement
+    :return: (np.ndarray) Codes of the kmers, the kmers holding a base other
+             than A, C, G and T being skipped.
+    """
+    bases = _BASE_CODES[np.frombuffer(b"N".join(sequences), dtype=np.uint8)]
+    return _encode_kmers(bases, kmer_size, canonical)
+
+
+def _encode_kmers(bases, kmer_size, canonical=False):
+    """Encode the kmers of an array of base codes (see encode_read_block).
+
+    :param bases: (np.ndarray) uint8 base codes, 4 for the other characters.
+    :param kmer_size: (int) Size of the kmers.
+    :param canonical: (boolean) True->Encode each kmer as the smallest of
+                      it and its reverse complement
+    :return: (np.ndarray) Codes of the kmers without invalid bases.
+    """
+    nb_words = (kmer_size + 31) // 32
+    nb_kmers = len(bases) - kmer_size + 1
+    if nb_kmers <= 0:
+        shape = (0,) if nb_words == 1 else (0, nb_words)
+        return np.empty(shape, dtype=np.uint64)
+    invalid = np.concatenate(([0], np.cumsum(bases > 3)))
+    valid = invalid[kmer_size:] == invalid[:-kmer_size]
+    if nb_words == 1:
+        codes = _encode_windows(bases, kmer_size)[valid]
+    else:
+        head_size = kmer_size - 32 * (nb_words - 1)
+        words = _encode_windows(bases, 32)
+        codes = np.empty((nb_kmers, nb_words), dtype=np.uint64)
+        codes[:, 0] = _encode_windows(bases, head_size)[:nb_kmers]
+        for word in range(1, nb_words):
+            offset = head_size + 32 * (word - 1)
+            codes[:, word] = words[offset:offset + nb_kmers]
+        codes = codes[valid]
+    if canonical:
+        codes = canonical_codes(codes, kmer_size)
+    return codes
+
+
+def _sliding_min(values, window_size):
+    """Compute the minimum of every window of an array.
+
+    The minimums of the windows of 1, 2, 4... values are combined as the
+    codes of encode_read_block.
+
+    :param values: (np.ndarray) Values.
+    :param window_size: (int) Size of the windows.
+    :return: (np.ndarray) Minimum of each window, by start position.
+    """
+    window = values
+    size = 1
+    minimums = None
+    minimums_size = 0
+    remaining = window_size
+    while True:
+        if remaining & 1:
+            if minimums is None:
+                minimums = window
+            else:
+                minimums = np.minimum(minimums[:len(window) - minimums_size],
+                                      window[minimums_size:])
+            minimums_size += size
+        remaining >>= 1
+        if not remaining:
+            break
+        window = np.minimum(window[:-size], window[size:])
+        size *= 2
+    return minimums[:len(values) - window_size + 1]
+
+
+def _minimizer_hash(mmer, canonical=False):
+    """Compute the hash ordering the minimizer candidates of a kmer.
+
+    :param mmer: (str) Sequence of a candidate (32 bases at most).
+    :param canonical: (boolean) True->Hash the smallest of the candidate and
+                      its reverse complement
+    :return: (int) 64-bit hash of the candidate.
+    """
+    code = encode_kmer(mmer)
+    if canonical:
+        code = min(code, reverse_complement_code(code, len(mmer)))
+    return int(_mix64(np.array([code], dtype=np.uint64))[0])
+
+
+def cut_superkmer(read, kmer_size, minimizer_size, canonical=False):
+    """Cut read into super-kmers: runs of consecutive kmers that share
+    their minimizer.
+
+    The minimizer of a kmer is its mmer (sub-sequence of minimizer_size
+    bases) of smallest hash, hashes avoiding the bias of the lexicographic
+    order towards poly-A. A super-kmer of n kmers holds kmer_size + n - 1
+    bases.
+
+    :param read: (str) Sequence of a read, of A, C, G and T only.
+    :param kmer_size: (int) Size of the kmers.
+    :param minimizer_size: (int) Size of the minimizers, 32 at most.
+    :param canonical: (boolean) True->Compare the mmers under the smallest
+                      of them and their reverse complement, a kmer and its
+                      reverse complement then share their minimizer
+    :return: A generator object that iterate (minimizer hash, super-kmer)
+             tuples.
+    """
+    start = 0
+    current = None
+    for index, kmer in enumerate(cut_kmer(read, kmer_size)):
+        minimizer = min(_minimizer_hash(mmer, canonical)
+                        for mmer in cut_kmer(kmer, minimizer_size))
+        if current is not None and minimizer != current:
+            yield current, read[start:index - 1 + kmer_size]
+            start = index
+        current = minimizer
+    if current is not None:
+        yield current, read[start:]
+
+
+def cut_superkmer_block(sequences, kmer_size, minimizer_size,
+                        canonical=False):
+    """Cut a block of reads into super-kmers at once (see cut_superkmer).
+
+    The hashes of all the mmers are computed with vectorized shifts, the
+    minimizer of each kmer is the minimum of a sliding window over them,
+    and a super-kmer starts wherever the minimizer changes or a kmer holds
+    a base other than A, C, G and T.
+
+    :param sequences: (list) Sequences of the reads as bytes.
+    :param kmer_size: (int) Size of the kmers.
+    :param minimizer_size: (int) Size of the minimizers, 32 at most.
+    :param canonical: (boolean) True->Compare the mmers under the smallest
+                      of them and their reverse complement
+    :return: (np.ndarray, np.ndarray, np.ndarray, np.ndarray) uint8 base
+             codes of the joined reads, start and end offsets of the
+             super-kmers in them and uint64 hashes of their minimizers.
+    """
+    bases = _BASE_CODES[np.frombuffer(b"N".join(sequences), dtype=np.uint8)]
+    empty = np.empty(0, dtype=np.intp)
+    if len(bases) < kmer_size:
+        return bases, empty, empty, np.empty(0, dtype=np.uint64)
+    invalid = np.concatenate(([0], np.cumsum(bases > 3)))
+    valid = np.flatnonzero(invalid[kmer_size:] == invalid[:-kmer_size])
+    if not len(valid):
+        # Reads shorter than the kmers, or cut by other bases
+        return bases, empty, empty, np.empty(0, dtype=np.uint64)
+    mmers = _encode_windows(bases, minimizer_size)
+    if canonical:
+        mmers = canonical_codes(mmers, minimizer_size)
+    minimizers = _sliding_min(_mix64(mmers),
+                              kmer_size - minimizer_size + 1)[valid]
+    starts = np.ones(len(valid), dtype=bool)
+    starts[1:] = ((valid[1:] != valid[:-1] + 1)
+                  | (minimizers[1:] != minimizers[:-1]))
+    firsts = np.flatnonzero(starts)
+    lasts = np.append(firsts[1:], len(valid)) - 1
+    return bases, valid[firsts], valid[lasts] + kmer_size, minimizers[firsts]
+
+
+def _sort_order(codes):
+    """Compute the order sorting kmer codes (rows of words sort
+    lexicographically).
+
+    :param codes: (np.ndarray) Codes of the kmers (see encode_read_block).
+    :return: (np.ndarray) Stable sorting order.
+    """
+    if codes.ndim == 1:
+        return np.argsort(codes, kind="stable")
+    return np.lexsort(codes.T[::-1])
+
+
+def _unique_codes(codes):
+    """Count the distinct codes of a batch of kmers.
+
+    :param codes: (np.ndarray) Codes of the kmers (see encode_read_block).
+    :return: (np.ndarray, np.ndarray) Sorted unique codes and their counts.
+    """
+    if codes.ndim == 1:
+        return np.unique(codes, return_counts=True)
+    if not len(codes):
+        return codes, np.empty(0, dtype=np.int64)
+    # np.unique(axis=0) sorts a structured view, much slower than lexsort
+    codes = codes[_sort_order(codes)]
+    changes = (codes[1:] != codes[:-1]).any(axis=1)
+    starts = np.flatnonzero(np.concatenate(([True], changes)))
+    return codes[starts], np.diff(np.append(starts, len(codes)))
+
+
+def merge_kmer_counts(tables):
+    """Merge tables of kmer occurrences.
+
+    :param tables: (list) A list of (codes, counts) tables.
+    :return: (np.ndarray, np.ndarray) Sorted unique codes and their summed
+             counts.
+    """
+    tables = [table for table in tables if len(table[0]) > 0]
+    if not tables:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64)
+    if len(tables) == 1:
+        return tables[0]
+    codes = np.concatenate([codes for codes, _ in tables])
+    counts = np.concatenate([counts for _, counts in tables])
+    order = _sort_order(codes)
+    codes = codes[order]
+    changes = codes[1:] != codes[:-1]
+    if codes.ndim == 2:
+        changes = changes.any(axis=1)
+    starts = np.flatnonzero(np.concatenate(([True], changes)))
+    return codes[starts], np.add.reduceat(counts[order], starts)
+
+
+class _KmerItems(ItemsView):
+    """Items of a KmerTable, decoded by chunks of kmers."""
+
+    def __iter__(self):
+        return self._mapping.iter_items()
+
+
+class _KmerMapping(Mapping):
+    """Dictionnary view of a table of kmer occurrences with str keys.
+
+    Subclasses hold size kmers of kmer_size bases, iterate their (kmer,
+    count) pairs with iter_items and look up the count of a kmer code with
+    _count, 0 for an absent kmer.
+    """
+
+    def items(self):
+        return _KmerItems(self)
+
+    def __getitem__(self, kmer):
+        if not isinstance(kmer, str) or len(kmer) != self.kmer_size:
+            raise KeyError(kmer)
+        try:
+            code = encode_kmer(kmer)
+        except ValueError:
+            raise KeyError(kmer) from None
+        count = self._count(code)
+        if not count:
+            raise KeyError(kmer)
+        return int(count)
+
+    def __iter__(self):
+        for kmer, _ in self.iter_items():
+            yield kmer
+
+    def __len__(self):
+        return self.size
+
+
+class KmerTable(_KmerMapping):
+    """Hash table of kmer occurrences held in NumPy arrays.
+
+    Kmers are stored encoded as rows of uint64 words (see encode_read_block)
+    in the words array, beside an array of uint32 counts: about 20 bytes
+    per kmer of up to 32 bases instead of a str key and an int object.
+    Collisions are resolved by linear probing and the arrays double once
+    the table is 70% full.
+    Batches of codes are inserted and looked up with vectorized operations,
+    and the table reads as a dictionnary of kmer occurrences with str keys.
+    """
+
+    MAX_LOAD = 0.7
+
+    def __init__(self, kmer_size, capacity=0):
+        self.kmer_size = kmer_size
+        self.nb_words = (kmer_size + 31) // 32
+        self.size = 0
+        self._allocate(capacity)
+
+    @classmethod
+    def _nb_slots(cls, capacity):
+        """Compute the number of slots holding capacity kmers under the max
+        load."""
+        return max(16, 1 << (int(capacity / cls.MAX_LOAD) - 1).bit_length())
+
+    @classmethod
+    def table_nbytes(cls, kmer_size, capacity):
+        """Compute the memory taken by a table sized for capacity kmers.
+
+        :param kmer_size: (int) Size of the kmers.
+        :param capacity: (int) Number of distinct kmers.
+        :return: (int) Size of the arrays of the table in bytes.
+        """
+        return cls._nb_slots(capacity) * (8 * ((kmer_size + 31) // 32) + 5)
+
+    def _allocate(self, capacity):
+        """Allocate empty arrays holding capacity kmers under the max load."""
+        nb_slots = self._nb_slots(capacity)
+        self.words = np.zeros((nb_slots, self.nb_words), dtype=np.uint64)
+        self.counts = np.zeros(nb_slots, dtype=np.uint32)
+        self.used = np.zeros(nb_slots, dtype=bool)
+
+    @classmethod
+    def from_arrays(cls, kmer_size, codes, counts):
+        """Build a table from unique codes and their counts.
+
+        :param kmer_size: (int) Size of the kmers.
+        :param codes: (np.ndarray) Unique codes of the kmers.
+        :param counts: (np.ndarray) Occurrences of each kmer.
+        :return: (KmerTable) The table of kmer occurrences.
+        """
+        table = cls(kmer_size, len(codes))
+        table.add_codes(codes, counts)
+        return table
+
+    def _words(self, codes):
+        """Convert codes (arrays, or lists of Python integers) to an array
+        of one row of words per kmer."""
+        if isinstance(codes, np.ndarray) and codes.dtype == np.uint64:
+            return codes.reshape(-1, self.nb_words)
+        return np.array([_split_code(code, self.nb_words) for code in codes],
+                        dtype=np.uint64).reshape(-1, self.nb_words)
+
+    def _codes(self, words):
+        """Convert rows of words back to codes (see encode_read_block)."""
+        return words[:, 0].copy() if self.nb_words == 1 else words
+
+    def _probe(self, words):
+        """Find the slots of kmers.
+
+        :param words: (np.ndarray) Rows of words of the kmers.
+        :return: (np.ndarray, np.ndarray) Slot of each kmer, or the empty
+                 slot ending its probe sequence, and True for the kmers
+                 found.
+        """
+        mask = len(self.counts) - 1
+        slots = (_hash_codes(words) & np.uint64(mask)).astype(np.intp)
+        found = np.zeros(len(words), dtype=bool)
+        pending = np.arange(len(words))
+        while len(pending):
+            pending_slots = slots[pending]
+            used = self.used[pending_slots]
+            match = used & (self.words[pending_slots]
+                            == words[pending]).all(axis=1)
+            found[pending[match]] = True
+            pending = pending[used & ~match]
+            slots[pending] = (slots[pending] + 1) & mask
+        return slots, found
+
+    def _insert(self, words, counts):
+        """Insert unique kmers, the table having room for all of them."""
+        slots, found = self._probe(words)
+        self.counts[slots[found]] += counts[found]
+        mask = len(self.counts) - 1
+        new = np.flatnonzero(~found)
+        while len(new):
+            # Several new kmers may end on the same empty slot: the first
+            # takes it, the others probe further
+            moving = new[self.used[slots[new]]]
+            while len(moving):
+                slots[moving] = (slots[moving] + 1) & mask
+                moving = moving[self.used[slots[moving]]]
+            claimed, first = np.unique(slots[new], return_index=True)
+            winners = new[first]
+            self.used[claimed] = True
+            self.words[claimed] = words[winners]
+            self.counts[claimed] = counts[winners]
+            self.size += len(winners)
+            new = np.setdiff1d(new, winners, assume_unique=True)
+
+    def add_codes(self, codes, counts=None):
+        """Count a batch of encoded kmers.
+
+        :param codes: (np.ndarray) Codes of the kmers (see encode_kmer),
+                      unique when counts are given.
+        :param counts: (np.ndarray) Occurrences of each kmer, None to count
+                       the codes.
+        """
+        if counts is None:
+            codes, counts = _unique_codes(np.asarray(codes))
+        words = self._words(codes)
+        if not len(words):
+            return
+        counts = np.asarray(counts, dtype=np.uint32)
+        if self.size + len(words) > self.MAX_LOAD * len(self.counts):
+            old_words = self.words[self.used]
+            old_counts = self.counts[self.used]
+            self._allocate(self.size + len(words))
+            self.size = 0
+            self._insert(old_words, old_counts)
+        self._insert(words, counts)
+
+    def get_counts(self, codes):
+        """Look up the counts of a batch of encoded kmers.
+
+        :param codes: (np.ndarray) Codes of the kmers (see encode_kmer).
+        :return: (np.ndarray) uint32 counts, 0 for the absent kmers.
+        """
+        words = self._words(codes)
+        slots, found = self._probe(words)
+        counts = np.zeros(len(words), dtype=np.uint32)
+        counts[found] = self.counts[slots[found]]
+        return counts
+
+    def to_arrays(self):
+        """Export the table as arrays.
+
+        :return: (np.ndarray, np.ndarray) Sorted unique codes of the kmers
+                 (see encode_read_block) and their counts.
+        """
+        codes = self._codes(self.words[self.used])
+        order = _sort_order(codes)
+        return codes[order], self.counts[self.used][order].astype(np.int64)
+
+    @property
+    def nbytes(self):
+        """Memory taken by the arrays of the table, in bytes."""
+        return self.words.nbytes + self.counts.nbytes + self.used.nbytes
+
+    def iter_items(self):
+        """Iterate on the (kmer, count) pairs of the table.
+
+        :return: A generator of (str, int) pairs.
+        """
+        slots = np.flatnonzero(self.used)
+        for start in range(0, len(slots), 1 << 20):
+            chunk = slots[start:start + (1 << 20)]
+            kmers = decode_kmer_codes(self._codes(self.words[chunk]),
+                                      self.kmer_size)
+            yield from zip(kmers, self.counts[chunk].tolist())
+
+    def _count(self, code):
+        return self.get_counts([code])[0]
+
+
+# Header of the sorted kmer table files, 64 bytes
+_TABLE_MAGIC = b"DBGKMERS"
+# Version of the layout of the table files, raised when it changes
+TABLE_VERSION = 1
+_TABLE_HEADER = np.dtype([("magic", "S8"), ("version", "<u4"),
+                          ("kmer_size", "<u4"), ("nb_words", "<u4"),
+                          ("canonical", "<u4"), ("nb_kmers", "<u8"),
+                          ("prefix_bits", "<u4"), ("reserved", "<u4", 7)])
+
+
+def _prefix_bits(nb_kmers, kmer_size):
+    """Choose the number of bits of the prefix index of a table.
+
+    :param nb_kmers: (int) Number of kmers of the table.
+    :param kmer_size: (int) Size of the kmers.
+    :return: (int, int) Number of bits of the prefixes, about one prefix
+             per 16 kmers, and their shift in the first word of the codes.
     """
-    if not os.path.isfile(path):
-        if os.path.isdir(path):
-            msg = "{0} is a directory".format(path)
-        else:
-            msg = "{0} does not exist.".format(path)
-        raise argparse.ArgumentTypeError(msg)
-    return path
+    head_bits = 2 * (kmer_size - 32 * ((kmer_size + 31) // 32 - 1))
+    prefix_bits = min(head_bits, 24, (nb_kmers // 16).bit_length())
+    return prefix_bits, head_bits - prefix_bits
 
 
-def get_arguments(): # pragma: no cover
-    """Retrieves the arguments of the program.
+def _prefix_index(words, kmer_size):
+    """Index sorted kmer codes by their first bits.
 
-    :return: An object that contains the arguments
+    :param words: (np.ndarray) Sorted unique codes of the kmers, as rows of
+                  words.
+    :param kmer_size: (int) Size of the kmers.
+    :return: (int, np.ndarray) Number of bits of the prefixes (see
+             _prefix_bits) and the position of the first kmer of each
+             prefix (one more for the end of the table).
     """
-    # Parsing arguments
-    parser = argparse.ArgumentParser(description=__doc__, usage=
-                                     "{0} -h"
-                                     .format(sys.argv[0]))
-    parser.add_argument('-i', dest='fastq_file', type=isfile,
-                        required=True, help="Fastq file")
-    parser.add_argument('-k', dest='kmer_size', type=int,
-                        default=22, help="k-mer size (default 22)")
-    parser.add_argument('-o', dest='output_file', type=str,
-                        default=os.curdir + os.sep + "contigs.fasta",
-                        help="Output contigs in fasta file (default contigs.fasta)")
-    parser.add_argument('-f', dest='graphimg_file', type=str,
-                        help="Save graph as an image (png)")
-    return parser.parse_args()
+    prefix_bits, shift = _prefix_bits(len(words), kmer_size)
+    prefixes = words[:, 0] >> np.uint64(shift)
+    return prefix_bits, np.searchsorted(
+        prefixes, np.arange((1 << prefix_bits) + 1, dtype=np.uint64))
 
 
-def read_fastq(fastq_file):
-    """Extract reads from fastq files.
+def write_kmer_table(table_file, kmer_size, codes, counts, canonical=False):
+    """Write sorted kmer occurrences as a table file (see
+    write_kmer_chunks).
 
-    :param fastq_file: (str) Path to the fastq file.
-    :return: A generator object that iterate the read sequences. 
+    :param table_file: (str) Path to the table file.
+    :param kmer_size: (int) Size of the kmers.
+    :param codes: (np.ndarray) Sorted unique codes of the kmers (see
+                  encode_read_block).
+    :param counts: (np.ndarray) Occurrences of each kmer.
+    :param canonical: (boolean) True->The kmers were counted canonical
     """
-    with open(fastq_file, 'r') as filin:
-        for line in filin:
-            yield next(filin).strip()
-            next(filin)
-            next(filin)
-    pass
+    write_kmer_chunks(table_file, kmer_size, [(codes, counts)], len(codes),
+                      canonical)
 
 
-def cut_kmer(read, kmer_size):
-    """Cut read into kmers of size kmer_size.
-    
-    :param read: (str) Sequence of a read.
-    :return: A generator object that iterate the kmers of of size kmer_size.
+def write_kmer_chunks(table_file, kmer_size, chunks, max_kmers,
+                      canonical=False):
+    """Write sorted chunks of kmer occurrences as a table file.
+
+    The file holds a header (see _TABLE_HEADER), the sorted codes as
+    little-endian uint64 words, the uint32 counts and a prefix index: the
+    position of the first kmer of each value of the first bits of the codes
+    (see _prefix_bits). The counts wait in a temporary file until the last
+    codes are written, so that a chunk at a time is held in memory. The
+    table goes to a temporary file renamed once complete, so that an
+    interrupted run leaves no partial table.
+
+    :param table_file: (str) Path to the table file.
+    :param kmer_size: (int) Size of the kmers.
+    :param chunks: An iterable object of (codes, counts) chunks, each one
+                   sorted and following the previous one.
+    :param max_kmers: (int) Upper bound of the number of kmers, sizing the
+                      prefix index.
+    :param canonical: (boolean) True->The kmers were counted canonical
     """
-    for i in range(len(read) - kmer_size + 1):
-        kmer = read[i:i + kmer_size]
-        yield kmer   
-    pass
+    nb_words = (kmer_size + 31) // 32
+    prefix_bits, shift = _prefix_bits(max_kmers, kmer_size)
+    sizes = np.zeros(1 << prefix_bits, dtype=np.int64)
+    nb_kmers = 0
+    table_dir = os.path.dirname(os.path.abspath(table_file))
+    with open(table_file + ".tmp", 'wb') as filout, \
+            tempfile.TemporaryFile(dir=table_dir) as counts_file:
+        filout.seek(_TABLE_HEADER.itemsize)
+        for codes, counts in chunks:
+            words = np.asarray(codes, dtype="<u8").reshape(-1, nb_words)
+            words.tofile(filout)
+            np.minimum(counts, 0xFFFFFFFF).astype("<u4").tofile(counts_file)
+            sizes += np.bincount((words[:, 0] >> np.uint64(shift))
+                                 .astype(np.intp), minlength=len(sizes))
+            nb_kmers += len(words)
+        counts_file.seek(0)
+        shutil.copyfileobj(counts_file, filout)
+        # Pad the counts so that the index is aligned on 8 bytes
+        np.zeros(nb_kmers % 2, dtype="<u4").tofile(filout)
+        np.concatenate(([0], np.cumsum(sizes))).astype("<u8").tofile(filout)
+        header = np.zeros(1, dtype=_TABLE_HEADER)
+        header[0] = (_TABLE_MAGIC, TABLE_VERSION, kmer_size, nb_words,
+                     canonical, nb_kmers, prefix_bits, 0)
+        filout.seek(0)
+        header.tofile(filout)
+    os.replace(table_file + ".tmp", table_file)
+
+
+class SortedKmerTable(_KmerMapping):
+    """Table of kmer occurrences held as sorted arrays.
+
+    The arrays come from a sort-based counting (see count_kmers_sorted) or
+    from a table file mapped in memory (see load_kmer_table). Batches of
+    codes are looked up with a binary search bounded by a prefix index (see
+    _prefix_index), and the table reads as a dictionnary of kmer
+    occurrences with str keys.
+    """
+
+    def __init__(self, kmer_size, codes, counts, canonical=False,
+                 index=None):
+        self.kmer_size = kmer_size
+        self.nb_words = (kmer_size + 31) // 32
+        self.canonical = canonical
+        self.words = codes.reshape(-1, self.nb_words)
+        self.counts = counts
+        self.size = len(self.words)
+        if index is None:
+            _, index = _prefix_index(self.words, kmer_size)
+        prefix_bits = (len(index) - 1).bit_length() - 1
+        head_bits = 2 * (kmer_size - 32 * (self.nb_words - 1))
+        self._shift = np.uint64(head_bits - prefix_bits)
+        # A mapped index is kept as it is, its entries being cast when read
+        self.index = index
+
+    @classmethod
+    def from_chunks(cls, kmer_size, chunks, canonical=False):
+        """Gather sorted chunks of kmer occurrences in a table.
+
+        :param kmer_size: (int) Size of the kmers.
+        :param chunks: An iterable object of (codes, counts) chunks, each
+                       one sorted and following the previous one.
+        :param canonical: (boolean) True->The kmers were counted canonical
+        :return: (SortedKmerTable) The table of kmer occurrences.
+        """
+        nb_words = (kmer_size + 31) // 32
+        codes = [np.empty((0, nb_words), dtype=np.uint64)]
+        counts = [np.empty(0, dtype=np.int64)]
+        for chunk_codes, chunk_counts in chunks:
+            codes.append(chunk_codes.reshape(-1, nb_words))
+            counts.append(chunk_counts)
+        return cls(kmer_size, np.concatenate(codes), np.concatenate(counts),
+                   canonical)
+
+    def rank(self, codes):
+        """Find the position of a batch of encoded kmers in the table.
+
+        :param codes: (np.ndarray) Codes of the kmers (see encode_read_block).
+        :return: (np.ndarray) Position of the first kmer of the table not
+                 smaller than each kmer.
+        """
+        words = np.asarray(codes, dtype=np.uint64).reshape(-1, self.nb_words)
+        prefixes = (words[:, 0] >> self._shift).astype(np.intp)
+        low = self.index[prefixes].astype(np.intp)
+        high = self.index[prefixes + 1].astype(np.intp)
+        keys = self.words if self.nb_words > 1 else self.words[:, 0]
+        codes = words if self.nb_words > 1 else words[:, 0]
+        active = np.flatnonzero(low < high)
+        while len(active):
+            middle = (low[active] + high[active]) // 2
+            less = _rows_less(keys[middle], codes[active])
+            low[active[less]] = middle[less] + 1
+            high[active[~less]] = middle[~less]
+            active = active[low[active] < high[active]]
+        return low
+
+    def lookup(self, codes):
+        """Look up the counts of a batch of encoded kmers.
+
+        :param codes: (np.ndarray) Codes of the kmers (see encode_read_block).
+        :return: (np.ndarray) uint32 counts, 0 for the absent kmers.
+        """
+        words = np.asarray(codes, dtype=np.uint64).reshape(-1, self.nb_words)
+        positions = self.rank(words)
+        found = np.flatnonzero(positions < self.size)
+        found = found[(self.words[positions[found]] == words[found])
+                      .all(axis=1)]
+        counts = np.zeros(len(words), dtype=np.uint32)
+        counts[found] = self.counts[positions[found]]
+        return counts
+
+    def to_arrays(self):
+        """Export the table as arrays.
+
+        :return: (np.ndarray, np.ndarray) Sorted unique codes of the kmers
+                 (see encode_read_block) and their counts.
+        """
+        codes = self.words[:, 0] if self.nb_words == 1 else self.words
+        return codes, self.counts.astype(np.int64)
+
+    def iter_items(self):
+        """Iterate on the (kmer, count) pairs of the table, sorted.
+
+        :return: A generator of (str, int) pairs.
+        """
+        # The words are sliced as they are, to_arrays copying the counts
+        codes = self.words[:, 0] if self.nb_words == 1 else self.words
+        for start in range(0, self.size, 1 << 20):
+            kmers = decode_kmer_codes(codes[start:start + (1 << 20)],
+                                      self.kmer_size)
+            yield from zip(kmers,
+                           self.counts[start:start + (1 << 20)].tolist())
+
+    def _count(self, code):
+        return self.lookup(np.array(_split_code(code, self.nb_words),
+                                    dtype=np.uint64))[0]
+
+
+def count_read_blocks(blocks, kmer_size, canonical=False, bloom=None,
+                      table=None, pipeline=False):
+    """Count the kmers of blocks of reads in a KmerTable.
+
+    The kmers of a whole block are encoded (see encode_read_block) and
+    inserted in the table at once. In a pipeline, the blocks are read by a
+    thread and encoded by another one while this one inserts them (see
+    iter_in_thread), the bounded queues between the threads holding back
+    the reading when the inserts lag behind.
+
+    With a Bloom filter, a kmer enters the table on its second sighting
+    only: the kmers seen once (mostly sequencing errors) never take a table
+    entry. The first sighting is added back when the kmer enters the table,
+    so counts stay exact, but a false positive of the filter lets a kmer
+    seen once in with a count of 2.
+
+    :param blocks: An iterable object of (sequences, qualities) blocks.
+    :param kmer_size: (int) Size of the kmers.
+    :param canonical: (boolean) True->Count each kmer with its reverse
+                      complement, under the smallest of both codes
+    :param bloom: (BloomFilter) Filter of the kmers seen once, None to
+                  count every kmer.
+    :param table: (KmerTable) Table updated with the occurrences, a new
+                  one by default.
+    :param pipeline: (boolean) True->Read, encode and insert the blocks in
+                     three threads
+    :return: (KmerTable) The table of kmer occurrences.
+    """
+    if table is None:
+        table = KmerTable(kmer_size)
+    if pipeline:
+        blocks = iter_in_thread(blocks)
+    batches = (_unique_codes(encode_read_block(sequences, kmer_size,
+                                               canonical))
+               for sequences, _ in blocks)
+    if pipeline:
+        batches = iter_in_thread(batches)
+    for codes, counts in batches:
+        if bloom is not None:
+            seen = bloom.add(_sketch_keys(codes))
+            # Kmers seen before but not in the table yet lost their first
+            # sighting to the filter
+            absorbed = seen & (table.get_counts(codes) == 0)
+            kept = seen | (counts > 1)
+            codes, counts = codes[kept], (counts + absorbed)[kept]
+        table.add_codes(codes, counts)
+    return table
 
-def build_kmer_dict(fastq_file, kmer_size):
-    """Build a dictionnary object of all kmer occurrences in the fastq file
 
-    :param fastq_file: (str) Path to the fastq file.
-    :return: A dictionnary object that identify all kmer occurrences.
+# Number of kmers sorted at once by the sort-based counting, 128 MB of
+# 64-bit codes
+RUN_SIZE = 1 << 24
+
+
+def count_kmers_sorted(blocks, kmer_size, canonical=False,
+                       run_size=RUN_SIZE, pipeline=False):
+    """Count the kmers of blocks of reads by sorting.
+
+    The codes of the kmers (see encode_read_block) are gathered in runs of
+    run_size kmers, each one sorted and collapsed into (code, count) pairs.
+    The runs are merged as they come, a run being merged with the previous
+    one once at least half its size, so that a few runs of growing sizes are
+    held at once. Sorting reads memory in sequence where the inserts of a
+    hash table land anywhere, at the cost of holding repeated kmers until
+    their run is sorted.
+
+    :param blocks: An iterable object of (sequences, qualities) blocks.
+    :param kmer_size: (int) Size of the kmers.
+    :param canonical: (boolean) True->Count each kmer with its reverse
+                      complement, under the smallest of both codes
+    :param run_size: (int) Number of kmers sorted at once.
+    :param pipeline: (boolean) True->Read, encode and sort the blocks in
+                     three threads (see count_read_blocks)
+    :return: (np.ndarray, np.ndarray) Sorted unique codes of the kmers and
+             their counts.
+    """
+    if pipeline:
+        blocks = iter_in_thread(blocks)
+    batches = (encode_read_block(sequences, kmer_size, canonical)
+               for sequences, _ in blocks)
+    if pipeline:
+        batches = iter_in_thread(batches)
+    runs = []
+    pending = []
+    nb_pending = 0
+    for codes in batches:
+        pending.append(codes)
+        nb_pending += len(pending[-1])
+        if nb_pending >= run_size:
+            _add_run(runs, np.concatenate(pending))
+            pending = []
+            nb_pending = 0
+    if pending:
+        _add_run(runs, np.concatenate(pending))
+    return merge_kmer_counts(runs)
+
+
+def _add_run(runs, codes):
+    """Sort a run of kmer codes into the list of sorted runs.
+
+    :param runs: (list) Sorted (codes, counts) runs, of decreasing sizes.
+    :param codes: (np.ndarray) Codes of the kmers of the run.
+    """
+    runs.append(_unique_codes(codes))
+    while len(runs) > 1 and len(runs[-2][0]) <= 2 * len(runs[-1][0]):
+        runs[-2:] = [merge_kmer_counts(runs[-2:])]
+
+
+def decode_kmer_codes(codes, kmer_size):
+    """Decode kmers encoded as integers.
+
+    :param codes: (np.ndarray) Codes of the kmers (see encode_read_block).
+    :param kmer_size: (int) Size of the kmers.
+    :return: (list) Sequences of the kmers.
+    """
+    if codes.ndim == 1:
+        codes = codes[:, np.newaxis]
+    nb_words = codes.shape[1]
+    # Bases held by each word, the first word holding the remainder
+    sizes = [kmer_size - 32 * (nb_words - 1)] + [32] * (nb_words - 1)
+    shifts = [np.arange(2 * size - 2, -1, -2, dtype=np.uint64)
+              for size in sizes]
+    kmers = []
+    for start in range(0, len(codes), 1 << 20):
+        chunk = codes[start:start + (1 << 20)]
+        letters = np.hstack([
+            _BASES[((chunk[:, word, np.newaxis] >> word_shifts)
+                    & np.uint64(3)).astype(np.intp)]
+            for word, word_shifts in enumerate(shifts)])
+        kmers.extend(letters.view("S{0}".format(kmer_size)).ravel()
+                     .astype(str).tolist())
+    return kmers
+
+
+def shard_bounds(codes, nb_shards, kmer_size):
+    """Choose the code ranges of shards from a sample of kmers.
+
+    The first words of the codes are cut at the quantiles of the sample, so
+    that the shards hold about as many kmers even when the codes are far
+    from uniform (canonical kmers favour the low codes). Without a sample,
+    the values of the first word are cut into equal ranges.
+
+    :param codes: (np.ndarray) Sorted unique codes of the sampled kmers.
+    :param nb_shards: (int) Number of shards.
+    :param kmer_size: (int) Size of the kmers.
+    :return: (np.ndarray) The nb_shards - 1 uint64 first words starting
+             the shards but the first one.
+    """
+    heads = codes if codes.ndim == 1 else codes[:, 0]
+    if len(heads):
+        return heads[len(heads) * np.arange(1, nb_shards) // nb_shards]
+    head_bits = 2 * (kmer_size - 32 * ((kmer_size + 31) // 32 - 1))
+    return np.array([(shard << head_bits) // nb_shards
+                     for shard in range(1, nb_shards)], dtype=np.uint64)
+
+
+def shard_kmer_counts(table, bounds):
+    """Split a sorted table of kmer occurrences into shards of code ranges.
+
+    Each kmer goes to the same shard whatever the table it comes from, and
+    the shards follow each other in code order.
+
+    :param table: (tuple) Sorted unique codes of the kmers and their counts.
+    :param bounds: (np.ndarray) First words starting the shards but the
+                   first one (see shard_bounds).
+    :return: (list) A list of len(bounds) + 1 (codes, counts) tables, views
+             on the table.
+    """
+    codes, counts = table
+    heads = codes if codes.ndim == 1 else codes[:, 0]
+    starts = np.concatenate(([0], np.searchsorted(heads, bounds),
+                             [len(heads)]))
+    return [(codes[begin:end], counts[begin:end])
+            for begin, end in zip(starts, starts[1:])]
+
+
+def _count_shards(blocks, kmer_size, canonical, bounds, prefix):
+    """Count the kmers of blocks of reads into shard files.
+
+    The kmers of each block are routed to their shard (see
+    shard_kmer_counts) as they are counted, one KmerTable per shard, and
+    each shard is saved sorted to prefix + "_<shard>.npy".
+
+    :param blocks: An iterable object of (sequences, qualities) blocks.
+    :param kmer_size: (int) Size of the kmers.
+    :param canonical: (boolean) True->Count each kmer with its reverse
+                      complement, under the smallest of both codes
+    :param bounds: (np.ndarray) Code ranges of the shards (see
+                   shard_bounds).
+    :param prefix: (str) Path prefix of the shard files.
+    """
+    tables = [KmerTable(kmer_size) for _ in range(len(bounds) + 1)]
+    for sequences, _ in blocks:
+        batch = _unique_codes(encode_read_block(sequences, kmer_size,
+                                                canonical))
+        shards = shard_kmer_counts(batch, bounds)
+        for table, shard in zip(tables, shards):
+            table.add_codes(*shard)
+    for shard, table in enumerate(tables):
+        with open("{0}_{1}.npy".format(prefix, shard), 'wb') as filout:
+            for array in table.to_arrays():
+                np.save(filout, array)
+
+
+def _count_kmers_range(task):
+    """Count the kmers of a byte range of a fastq file (worker process).
+
+    :param task: (tuple) Path to the fastq file, start and end offsets of
+                 the range, size of the kmers, trimming parameters,
+                 canonical flag, code ranges of the shards and path prefix
+                 of the shard files (see _count_shards).
+    """
+    (fastq_file, start, end, kmer_size, trimming, canonical, bounds,
+     prefix) = task
+    blocks = read_fastq_range(fastq_file, start, end)
+    if trimming is not None:
+        blocks = trim_read_blocks(blocks, **trimming)
+    _count_shards(blocks, kmer_size, canonical, bounds, prefix)
+
+
+def _merge_shard_files(shard_files):
+    """Merge the files of a shard (worker process).
+
+    :param shard_files: (list) Paths to the files of the shard (see
+                        _count_shards), removed once loaded.
+    :return: (np.ndarray, np.ndarray) Sorted unique codes of the kmers of
+             the shard and their counts.
+    """
+    tables = []
+    for shard_file in shard_files:
+        with open(shard_file, 'rb') as filin:
+            tables.append((np.load(filin), np.load(filin)))
+        os.remove(shard_file)
+    return merge_kmer_counts(tables)
+
+
+# Shards per counting process, smaller shards balancing the merges
+SHARDS_PER_PROCESS = 4
+
+
+def count_kmers_sharded(fastq_file, kmer_size, processes, trimming=None,
+                        canonical=False, index_reads=False, tmp_dir=None):
+    """Count kmers with worker processes and partitioned tables.
+
+    Uncompressed fastq files are split into byte ranges on record bounds,
+    or into ranges of as many records with a record index (see
+    index_fastq): each worker maps the file, counts its own range routing
+    the kmers to shards of code ranges (see shard_kmer_counts), and saves
+    the shards to files. Compressed files and standard input are counted
+    the same way by this process while the workers run. Each shard is then
+    merged by a worker from its files, the shards being disjoint ranges
+    of codes their results are only put end to end: the kmers pass through
+    this process once, already sorted.
+
+    Shards cut ranges of codes rather than hashes so that the merged
+    shards follow each other in code order. The ranges are cut at the
+    quantiles of the kmers of a first block of reads (see shard_bounds), and
+    SHARDS_PER_PROCESS shards per process even out what the sample misses.
+
+    :param fastq_file: (list) Read sources (see read_fastq).
+    :param kmer_size: (int) Size of the kmers.
+    :param processes: (int) Number of worker processes.
+    :param trimming: (dict) Parameters of trim_read_blocks, None to keep
+                     the reads as they are.
+    :param canonical: (boolean) True->Count each kmer with its reverse
+                      complement, under the smallest of both codes
+    :param index_reads: (boolean) True->Split the files on their record
+                        index, persisted next to them and reused by later
+                        runs
+    :param tmp_dir: (str) Directory of the shard files, the system
+                    temporary directory by default.
+    :return: (np.ndarray, np.ndarray) Sorted unique codes of the kmers and
+             their counts.
+    """
+    nb_shards = processes * SHARDS_PER_PROCESS
+    nb_words = (kmer_size + 31) // 32
+    plain_files = [path for path in fastq_file if is_plain_fastq(path)]
+    ranges = [(path, start, end) for path in plain_files
+              for start, end in split_fastq(
+                  path, processes,
+                  index_fastq(path, persist=True) if index_reads else None)]
+    blocks = load_read_blocks(
+        [path for path in fastq_file if path not in plain_files],
+        trimming=trimming)
+    if ranges:
+        sample_blocks = read_fastq_range(*ranges[0])
+        if trimming is not None:
+            sample_blocks = trim_read_blocks(sample_blocks, **trimming)
+        sample = next(sample_blocks, None)
+        sample_blocks.close()
+    else:
+        # The first block of this process is counted after the sample
+        sample = next(blocks, None)
+        if sample is not None:
+            blocks = itertools.chain([sample], blocks)
+    codes = np.empty(0, dtype=np.uint64)
+    if sample is not None:
+        codes, _ = _unique_codes(encode_read_block(sample[0], kmer_size,
+                                                   canonical))
+    bounds = shard_bounds(codes, nb_shards, kmer_size)
+    with tempfile.TemporaryDirectory(prefix="debruijn_",
+                                     dir=tmp_dir) as directory:
+        prefixes = [os.path.join(directory, "range_{0}".format(number))
+                    for number in range(len(ranges) + 1)]
+        tasks = [(path, start, end, kmer_size, trimming, canonical,
+                  bounds, prefix)
+                 for (path, start, end), prefix in zip(ranges, prefixes)]
+        with multiprocessing.Pool(processes) as pool:
+            counted = pool.map_async(_count_kmers_range, tasks)
+            _count_shards(blocks, kmer_size, canonical, bounds, prefixes[-1])
+            counted.get()
+            shards = pool.map(_merge_shard_files,
+                              [["{0}_{1}.npy".format(prefix, shard)
+                                for prefix in prefixes]
+                               for shard in range(nb_shards)], chunksize=1)
+    codes = np.concatenate([codes.reshape(-1, nb_words)
+                            for codes, _ in shards])
+    counts = np.concatenate([counts for _, counts in shards])
+    return codes[:, 0] if nb_words == 1 else codes, counts
+
+
+def count_kmers_approximate(blocks, kmer_size, sketch, min_count=2,
+                            canonical=False):
+    """Count kmers approximately in a Count-Min sketch.
+
+    The kmers of each block are added to the sketch with the conservative
+    update; the kmers whose estimate reaches min_count (solid kmers) are
+    kept in a separate KmerTable, and their counts are read from the sketch
+    at the end. Counts are never underestimated and are exceeded
+    by at most sketch.error_bound().
+
+    :param blocks: An iterable object of (sequences, qualities) blocks.
+    :param kmer_size: (int) Size of the kmers.
+    :param sketch: (CountMinSketch) Sketch receiving the counts.
+    :param min_count: (int) Minimum estimated count of the kmers kept.
+    :param canonical: (boolean) True->Count each kmer with its reverse
+                      complement, under the smallest of both codes
+    :return: (np.ndarray, np.ndarray) Sorted unique codes of the solid
+             kmers and their estimated counts.
+    """
+    solid = KmerTable(kmer_size)
+    for sequences, _ in blocks:
+        codes, counts = _unique_codes(
+            encode_read_block(sequences, kmer_size, canonical))
+        keys = _sketch_keys(codes)
+        sketch.add(keys, counts, conservative=True)
+        solid.add_codes(codes[sketch.query(keys) >= min_count])
+    codes, _ = solid.to_arrays()
+    return codes, sketch.query(_sketch_keys(codes)).astype(np.int64)
+
+
+# Bytes of memory needed to count one spilled kmer (code, sort, counts)
+BYTES_PER_KMER = 32
+# Size of the minimizers partitioning the kmers counted on disk
+MINIMIZER_SIZE = 15
+# File descriptors left to the rest of the process beside the bucket files
+RESERVED_FILES = 64
+
+
+def estimate_kmer_number(fastq_file):
+    """Roughly estimate the number of kmers of read files from their size.
+
+    Sequences take about half of a fastq file and nearly all of a fasta
+    file, and compressed files are assumed to be 4 times smaller than their
+    content.
+
+    :param fastq_file: (list) Read sources (see read_fastq).
+    :return: (int) Estimated number of kmers, 0 for standard input.
     """
-    kmer_dict = {}
-    for read in read_fastq(fastq_file):
-        for kmer in cut_kmer(read, 3):
-            if kmer in kmer_dict:
-                kmer_dict[kmer] += 1
+    nb_kmers = 0
+    for path in fastq_file:
+        if path == "-":
+            continue
+        size = os.path.getsize(path)
+        with open(path, 'rb') as filin:
+            if get_decompressor(filin.peek(6)[:6]) is not None:
+                nb_kmers += size * 2
+            elif detect_format(filin) == "fasta":
+                nb_kmers += size
             else:
-                kmer_dict[kmer] = 1
-    return kmer_dict
-    pass
+                nb_kmers += size // 2
+    return nb_kmers
+
+
+def max_bucket_files():
+    """Compute the number of bucket files that can be open at once.
+
+    :return: (int) The soft limit of open files of the process, less
+             RESERVED_FILES, 1024 less RESERVED_FILES when it is unknown.
+    """
+    limit = 1024
+    try:
+        import resource
+    except ImportError: # pragma: no cover
+        pass
+    else:
+        soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft != resource.RLIM_INFINITY:
+            limit = soft
+    return max(limit - RESERVED_FILES, 1)
+
+
+def _pack_superkmers(bases, starts, ends):
+    """Pack super-kmers as 2-bit bases, each padded to a whole number of
+    bytes by one to four bases.
 
-def build_graph(kmer_dict):
+    :param bases: (np.ndarray) uint8 base codes.
+    :param starts: (np.ndarray) Start offsets of the super-kmers in bases.
+    :param ends: (np.ndarray) End offsets of the super-kmers in bases.
+    :return: (np.ndarray, np.ndarray) uint8 packed bases and the offset of
+             each super-kmer in them (plus the total size).
+    """
+    lengths = ends - starts
+    padded = (lengths + 4) // 4 * 4
+    offsets = np.concatenate(([0], np.cumsum(padded)))
+    positions = np.arange(offsets[-1]) - np.repeat(offsets[:-1], padded)
+    inside = positions < np.repeat(lengths, padded)
+    codes = np.zeros(offsets[-1], dtype=np.uint8)
+    codes[inside] = bases[(np.repeat(starts, padded) + positions)[inside]]
+    return _pack_bases(codes), offsets // 4
+
+
+def _load_superkmers(bucket_file):
+    """Load the super-kmers spilled into a bucket file.
+
+    The file is a series of chunks: a uint64 number of super-kmers, their
+    uint32 lengths and their packed bases (see _pack_superkmers).
+
+    :param bucket_file: (str) Path to the bucket file.
+    :return: (np.ndarray) uint8 base codes of the super-kmers, separated by
+             their padding coded 4.
+    """
+    lengths = []
+    packed = []
+    with open(bucket_file, 'rb') as filin:
+        while True:
+            header = np.fromfile(filin, dtype=np.uint64, count=1)
+            if not len(header):
+                break
+            chunk_lengths = np.fromfile(filin, dtype=np.uint32,
+                                        count=int(header[0])).astype(np.intp)
+            lengths.append(chunk_lengths)
+            nb_bytes = int(((chunk_lengths + 4) // 4).sum())
+            packed.append(np.fromfile(filin, dtype=np.uint8, count=nb_bytes))
+    if not lengths:
+        return np.empty(0, dtype=np.uint8)
+    lengths = np.concatenate(lengths)
+    padded = (lengths + 4) // 4 * 4
+    bases = _unpack_bases(np.concatenate(packed), 0, int(padded.sum()))
+    positions = np.arange(len(bases)) - np.repeat(
+        np.cumsum(padded) - padded, padded)
+    bases[positions >= np.repeat(lengths, padded)] = 4
+    return bases
+
+
+def estimate_distinct_kmers(fastq_file, kmer_size, canonical=False,
+                            trimming=None, cache_dir=None, precision=14):
+    """Estimate the number of distinct kmers of reads in one streaming pass.
+
+    The kmers of each block are encoded and added to a HyperLogLog, which
+    takes 2**precision bytes whatever the number of kmers.
+
+    :param fastq_file: (str) Path to the fastq file, or a list of read
+                       sources (see read_fastq), standard input excluded.
+    :param kmer_size: (int) Size of the kmers.
+    :param canonical: (boolean) True->Count each kmer with its reverse
+                      complement
+    :param trimming: (dict) Parameters of trim_read_blocks, None to keep
+                     the reads as they are.
+    :param cache_dir: (str) Directory of the 2-bit read cache (see
+                      read_fastq).
+    :param precision: (int) Number of index bits of the HyperLogLog.
+    :return: (int, int) Estimated number of distinct kmers and exact number
+             of kmers.
+    """
+    estimator = HyperLogLog(precision)
+    nb_kmers = 0
+    for sequences, _ in load_read_blocks(fastq_file, cache_dir, trimming):
+        codes = encode_read_block(sequences, kmer_size, canonical)
+        estimator.add(_sketch_keys(codes))
+        nb_kmers += len(codes)
+    return min(estimator.estimate(), nb_kmers), nb_kmers
+
+
+def _count_bucket(bucket_file, kmer_size, canonical=False):
+    """Count the kmers of the super-kmers spilled into a bucket file.
+
+    :param bucket_file: (str) Path to the bucket file (see
+                        _load_superkmers).
+    :param kmer_size: (int) Size of the kmers.
+    :param canonical: (boolean) True->Count each kmer with its reverse
+                      complement, under the smallest of both codes
+    :return: (np.ndarray, np.ndarray) Sorted unique codes and their counts.
+    """
+    bases = _load_superkmers(bucket_file)
+    os.remove(bucket_file)
+    return _unique_codes(_encode_kmers(bases, kmer_size, canonical))
+
+
+def _count_bucket_task(task):
+    """Count a bucket file in a worker process (see _count_bucket).
+
+    :param task: (tuple) Arguments of _count_bucket.
+    :return: (np.ndarray, np.ndarray) Sorted unique codes and their counts.
+    """
+    return _count_bucket(*task)
+
+
+def count_kmers_external(blocks, kmer_size, nb_buckets, canonical=False,
+                         tmp_dir=None, processes=1,
+                         minimizer_size=MINIMIZER_SIZE, table=None,
+                         max_memory=None):
+    """Count kmers out of memory, through bucket files on disk.
+
+    The reads of each block are cut into super-kmers (see
+    cut_superkmer_block), which are packed as 2-bit bases and spilled into
+    nb_buckets files by hash of their minimizer: a super-kmer of n kmers
+    takes about (kmer_size + n) / 4 bytes instead of n codes, and all the
+    occurrences of a kmer land in the same bucket. Each bucket is then
+    loaded and counted on its own, and its kmers, found in no other bucket,
+    are inserted into the table as soon as counted. Only one block and one
+    bucket per process are held in memory beside the table.
+
+    :param blocks: An iterable object of (sequences, qualities) blocks.
+    :param kmer_size: (int) Size of the kmers.
+    :param nb_buckets: (int) Number of bucket files.
+    :param canonical: (boolean) True->Count each kmer with its reverse
+                      complement, under the smallest of both codes
+    :param tmp_dir: (str) Directory of the bucket files, the system
+                    temporary directory by default.
+    :param processes: (int) Number of processes counting the buckets.
+    :param minimizer_size: (int) Size of the minimizers, 32 at most (and
+                           kmer_size at most).
+    :param table: (KmerTable) Table the kmers are counted into, presized
+                  for the number of distinct kmers, a new one by default.
+    :param max_memory: (int) Memory budget of the table in bytes, None for
+                       no bound.
+    :raises ValueError: If the table grows over max_memory
+    :return: (KmerTable) The table of kmer occurrences.
+    """
+    if table is None:
+        table = KmerTable(kmer_size)
+    minimizer_size = min(minimizer_size, kmer_size, 32)
+    with tempfile.TemporaryDirectory(prefix="debruijn_", dir=tmp_dir) as directory:
+        bucket_files = [os.path.join(directory, "bucket_{0}.bin".format(bucket))
+                        for bucket in range(nb_buckets)]
+        with contextlib.ExitStack() as stack:
+            outputs = [stack.enter_context(open(path, 'wb'))
+                       for path in bucket_files]
+            for sequences, _ in blocks:
+                bases, starts, ends, minimizers = cut_superkmer_block(
+                    sequences, kmer_size, minimizer_size, canonical)
+                buckets = (minimizers % np.uint64(nb_buckets)).astype(np.intp)
+                order = np.argsort(buckets, kind="stable")
+                bounds = np.searchsorted(buckets[order], np.arange(nb_buckets + 1))
+                starts = starts[order]
+                ends = ends[order]
+                packed, offsets = _pack_superkmers(bases, starts, ends)
+                for bucket, (begin, end) in enumerate(zip(bounds, bounds[1:])):
+                    if begin < end:
+                        output = outputs[bucket]
+                        np.array([end - begin], dtype=np.uint64).tofile(output)
+                        (ends[begin:end] - starts[begin:end]).astype(
+                            np.uint32).tofile(output)
+                        packed[offsets[begin]:offsets[end]].tofile(output)
+        tasks = [(path, kmer_size, canonical) for path in bucket_files]
+        if processes > 1:
+            with multiprocessing.Pool(processes) as pool:
+                for codes, counts in pool.imap_unordered(_count_bucket_task,
+                                                         tasks):
+                    _add_bucket(table, codes, counts, max_memory)
+        else:
+            for task in tasks:
+                _add_bucket(table, *_count_bucket(*task), max_memory)
+    return table
+
+
+def _add_bucket(table, codes, counts, max_memory=None):
+    """Insert the counts of a bucket into the table of an external count.
+
+    :param table: (KmerTable) The table of kmer occurrences.
+    :param codes: (np.ndarray) Unique codes of the kmers of the bucket.
+    :param counts: (np.ndarray) Occurrences of each kmer.
+    :param max_memory: (int) Memory budget of the table in bytes, None for
+                       no bound.
+    :raises ValueError: If the table grows over max_memory
+    """
+    table.add_codes(codes, counts)
+    if max_memory is not None and table.nbytes > max_memory:
+        raise ValueError("The k-mer table ({0} bytes) exceeds the memory "
+                         "budget of {1} bytes.".format(table.nbytes,
+                                                       max_memory))
+
+
+def build_kmer_dict(fastq_file, kmer_size, processes=1, cache_dir=None,
+                    trimming=None, normalization=None, canonical=False,
+                    max_memory=None, tmp_dir=None, bloom_error_rate=None,
+                    sketch=None, min_count=2, kmer_estimate=None,
+                    engine="hash", pipeline=False, index_reads=False):
+    """Build a dictionnary object of all kmer occurrences in the fastq file
+
+    Kmers are counted encoded as integers by blocks of reads in a KmerTable
+    (see count_read_blocks), read as a dictionnary, or by sorting runs of
+    kmers into a SortedKmerTable with the sort engine (see
+    count_kmers_sorted). With several processes, the
+    counting is sharded between worker processes (see count_kmers_sharded).
+    Under a memory budget, kmers are counted through bucket files on disk
+    (see count_kmers_external), one bucket per process at once. With a
+    Bloom filter, the kmers seen once are left out of the table (see
+    count_read_blocks), counting is then done in this process. With a
+    Count-Min sketch, only the solid kmers are kept, with approximate counts
+    (see count_kmers_approximate).
+
+    :param fastq_file: (str) Path to the fastq file, or a list of read
+                       sources (see read_fastq).
+    :param processes: (int) Number of worker processes.
+    :param cache_dir: (str) Directory of the 2-bit read cache (see
+                      read_fastq), reads are then counted in this process.
+    :param trimming: (dict) Parameters of trim_read_blocks applied to the
+                     reads before counting, None to keep them as they are.
+    :param normalization: (dict) Parameters of normalize_read_blocks (but
+                          kmer_size), reads are then counted in this process.
+    :param canonical: (boolean) True->Count each kmer with its reverse
+                      complement, under the smallest of both
+    :param max_memory: (int) Memory budget of the counting in bytes, None
+                       to count in memory. The table, presized from
+                       kmer_estimate, takes its share first and the rest
+                       sizes the bucket files, as many as can be open at
+                       once (see max_bucket_files).
+    :param tmp_dir: (str) Directory of the bucket files of the counting
+                    under a memory budget.
+    :param bloom_error_rate: (float) False positive rate of the Bloom filter
+                             of the kmers seen once, None to count them.
+    :param sketch: (CountMinSketch) Sketch of the approximate counting, None
+                   to count exactly.
+    :param min_count: (int) Minimum estimated count of the kmers kept by the
+                      approximate counting.
+    :param kmer_estimate: (tuple) Numbers of distinct kmers and of kmers
+                          (see estimate_distinct_kmers) sizing the table,
+                          the Bloom filter and the bucket files up front,
+                          None to size them from the size of the files.
+                          The Bloom filter of read files is then sized on
+                          an estimate made in a first pass, and for
+                          2**24 kmers on standard input.
+    :param engine: (str) Counting engine in this process without Bloom
+                   filter nor sketch: hash (KmerTable) or sort
+                   (SortedKmerTable).
+    :param pipeline: (boolean) True->Read, encode and count the reads in
+                     three threads when counting in this process (see
+                     count_read_blocks)
+    :param index_reads: (boolean) True->Split the fastq files between the
+                        worker processes on their persisted record index
+                        (see count_kmers_sharded)
+    :raises ValueError: If the kmer table exceeds max_memory
+    :return: (KmerTable or SortedKmerTable) A dictionnary object that
+             identify all kmer occurrences.
+    """
+    if isinstance(fastq_file, str):
+        fastq_file = [fastq_file]
+    sharded = (processes > 1 and max_memory is None and cache_dir is None
+               and normalization is None and bloom_error_rate is None
+               and sketch is None)
+    if sharded:
+        codes, counts = count_kmers_sharded(fastq_file, kmer_size, processes,
+                                            trimming, canonical, index_reads,
+                                            tmp_dir)
+        return SortedKmerTable(kmer_size, codes, counts, canonical)
+    blocks = load_read_blocks(fastq_file, cache_dir, trimming)
+    if normalization is not None:
+        blocks = normalize_read_blocks(blocks, kmer_size, **normalization)
+    if kmer_estimate is not None:
+        nb_distinct, nb_kmers = kmer_estimate
+    elif (bloom_error_rate is not None and max_memory is None
+          and sketch is None and "-" not in fastq_file):
+        # The filter holds the distinct kmers, far fewer than their
+        # occurrences, which the size of the files gives
+        nb_distinct, nb_kmers = estimate_distinct_kmers(
+            fastq_file, kmer_size, canonical, trimming, cache_dir)
+    else:
+        nb_kmers = estimate_kmer_number(fastq_file)
+        nb_distinct = None
+    if max_memory is not None:
+        table = KmerTable(kmer_size, int((nb_distinct or 0) * 1.05))
+        # The buckets share the budget left by the table
+        budget = max_memory - table.nbytes
+        if budget <= 0:
+            raise ValueError("The k-mer table ({0} bytes) exceeds the memory "
+                             "budget of {1} bytes.".format(table.nbytes,
+                                                           max_memory))
+        nb_buckets = -(-nb_kmers * BYTES_PER_KMER * max(processes, 1)
+                       // budget)
+        nb_buckets = min(max(nb_buckets, 1), max_bucket_files())
+        return count_kmers_external(blocks, kmer_size, nb_buckets, canonical,
+                                    tmp_dir, processes, table=table,
+                                    max_memory=max_memory)
+    elif sketch is not None:
+        codes, counts = count_kmers_approximate(blocks, kmer_size, sketch,
+                                                min_count, canonical)
+    elif engine == "sort" and bloom_error_rate is None:
+        codes, counts = count_kmers_sorted(blocks, kmer_size, canonical,
+                                           pipeline=pipeline)
+        return SortedKmerTable(kmer_size, codes, counts, canonical)
+    else:
+        bloom = None
+        capacity = nb_distinct or 0
+        if bloom_error_rate is not None:
+            bloom = BloomFilter(nb_distinct or nb_kmers or 1 << 24,
+                                bloom_error_rate)
+            # The table only takes the kmers seen twice
+            capacity = 0
+        # A margin over the estimate keeps the table from growing
+        table = KmerTable(kmer_size, int(capacity * 1.05))
+        return count_read_blocks(blocks, kmer_size, canonical, bloom, table,
+                                 pipeline)
+    return KmerTable.from_arrays(kmer_size, codes, counts)
+
+
+def benchmark_engines(fastq_file, kmer_size, canonical=False, trimming=None,
+                      cache_dir=None):
+    """Time the hash and sort counting engines on the same reads.
+
+    The reads are loaded in memory first, so that only the counting is
+    timed.
+
+    :param fastq_file: (str) Path to the fastq file, or a list of read
+                       sources (see read_fastq).
+    :param kmer_size: (int) Size of the kmers.
+    :param canonical: (boolean) True->Count each kmer with its reverse
+                      complement, under the smallest of both
+    :param trimming: (dict) Parameters of trim_read_blocks applied to the
+                     reads before counting, None to keep them as they are.
+    :param cache_dir: (str) Directory of the 2-bit read cache (see
+                      read_fastq).
+    :return: (list) A list of (engine, seconds, number of distinct kmers)
+             tuples.
+    """
+    if isinstance(fastq_file, str):
+        fastq_file = [fastq_file]
+    blocks = list(load_read_blocks(fastq_file, cache_dir, trimming))
+    timings = []
+    for engine in ("hash", "sort"):
+        start = time.perf_counter()
+        if engine == "hash":
+            nb_distinct = len(count_read_blocks(blocks, kmer_size, canonical))
+        else:
+            codes, _ = count_kmers_sorted(blocks, kmer_size, canonical)
+            nb_distinct = len(codes)
+        timings.append((engine, time.perf_counter() - start, nb_distinct))
+    return timings
+
+
+def save_kmer_table(table, table_file, canonical=False):
+    """Store a table of kmer occurrences as a table file (see
+    write_kmer_table).
+
+    :param table: (KmerTable) The table of kmer occurrences.
+    :param table_file: (str) Path to the table file.
+    :param canonical: (boolean) True->The kmers were counted canonical
+    """
+    codes, counts = table.to_arrays()
+    write_kmer_table(table_file, table.kmer_size, codes, counts, canonical)
+
+
+def load_kmer_table(table_file):
+    """Open a table file of kmer occurrences.
+
+    The file is mapped in memory without being read, its pages being read
+    as the table is looked up.
+
+    :param table_file: (str) Path to the table file (see write_kmer_table).
+    :raises ValueError: If the file is not a kmer table
+    :return: (SortedKmerTable) The table of kmer occurrences, mapped.
+    """
+    with open(table_file, 'rb') as filin:
+        table_map = mmap.mmap(filin.fileno(), 0, access=mmap.ACCESS_READ)
+    header = np.frombuffer(table_map, dtype=_TABLE_HEADER, count=1)[0]
+    if header["magic"] != _TABLE_MAGIC or header["version"] != TABLE_VERSION:
+        raise ValueError("{0} is not a kmer table.".format(table_file))
+    kmer_size = int(header["kmer_size"])
+    nb_words = int(header["nb_words"])
+    size = int(header["nb_kmers"])
+    # The arrays are views on the map, which they keep open
+    offset = _TABLE_HEADER.itemsize
+    words = np.frombuffer(table_map, dtype="<u8", count=size * nb_words,
+                          offset=offset)
+    offset += words.nbytes
+    counts = np.frombuffer(table_map, dtype="<u4", count=size, offset=offset)
+    offset += 4 * (size + size % 2)
+    index = np.frombuffer(table_map, dtype="<u8",
+                          count=(1 << int(header["prefix_bits"])) + 1,
+                          offset=offset)
+    return SortedKmerTable(kmer_size, words, counts,
+                           bool(header["canonical"]), index)
+
+
+def _load_matching_table(table_file, kmer_size, canonical):
+    """Open a table file of kmer occurrences counted as expected.
+
+    :param table_file: (str) Path to the table file (see write_kmer_chunks).
+    :param kmer_size: (int) Expected size of the kmers.
+    :param canonical: (boolean) Expected canonical mode of the kmers.
+    :raises ValueError: If the table has another kmer size or canonical
+                        mode
+    :return: (SortedKmerTable) The table of kmer occurrences, mapped.
+    """
+    table = load_kmer_table(table_file)
+    if (table.kmer_size, table.canonical) != (kmer_size, canonical):
+        raise ValueError(
+            "The table {0} holds {1}kmers of size {2}.".format(
+                table_file, "canonical " if table.canonical else "",
+                table.kmer_size))
+    return table
+
+
+def update_kmer_table(table_file, fastq_file, kmer_size, canonical=False,
+                      cache_dir=None, trimming=None, **options):
+    """Count new reads into a stored table of kmer occurrences.
+
+    Only the new reads are counted (see build_kmer_dict), their sorted table
+    is then merged with the stored one (created when missing) into a new
+    table file (see merge_kmer_tables).
+
+    :param table_file: (str) Path to the table file (see write_kmer_table).
+    :param fastq_file: (str) Path to the fastq file of the new reads, or a
+                       list of read sources (see read_fastq).
+    :param kmer_size: (int) Size of the kmers.
+    :param canonical: (boolean) True->Count each kmer with its reverse
+                      complement
+    :param cache_dir: (str) Directory of the 2-bit read cache (see
+                      read_fastq).
+    :param trimming: (dict) Parameters of trim_read_blocks, None to keep
+                     the reads as they are.
+    :param options: Other counting options of build_kmer_dict (processes,
+                    normalization, max_memory, engine...).
+    :raises ValueError: If the stored table has another kmer size or
+                        canonical mode
+    :return: (SortedKmerTable, KmerTable) The updated table and the table
+             of the new reads.
+    """
+    tables = []
+    if os.path.exists(table_file):
+        tables.append(_load_matching_table(table_file, kmer_size, canonical))
+    new_table = build_kmer_dict(fastq_file, kmer_size, cache_dir=cache_dir,
+                                trimming=trimming, canonical=canonical,
+                                **options)
+    tables.append(SortedKmerTable(kmer_size, *new_table.to_arrays(),
+                                  canonical))
+    write_kmer_chunks(table_file, kmer_size, merge_kmer_tables(tables),
+                      sum(len(table) for table in tables), canonical)
+    return load_kmer_table(table_file), new_table
+
+
+def merge_kmer_tables(tables, operation="sum", chunk_size=1 << 20):
+    """Merge sorted tables of kmer occurrences chunk by chunk.
+
+    Each step takes the kmers of every table up to a bound, the smallest of
+    the codes chunk_size kmers ahead in each table, so that at most
+    chunk_size kmers of each table are held at once. Operations:
+
+    - sum: kmers of any table, with their summed counts;
+    - min: kmers of every table, with their smallest count;
+    - intersection: kmers of every table, with their summed counts;
+    - difference: kmers of the first table missing from the others, with
+      their counts in the first table.
+
+    :param tables: (list) A list of SortedKmerTable, of the same kmer size
+                   and canonical mode.
+    :param operation: (str) One of sum, min, intersection and difference.
+    :param chunk_size: (int) Number of kmers taken from each table at once.
+    :raises ValueError: If the tables have other kmer sizes or canonical
+                        modes, or for an unknown operation
+    :return: A generator of sorted (codes, counts) chunks, each one
+             following the previous one.
+    """
+    if operation not in ("sum", "min", "intersection", "difference"):
+        raise ValueError("Unknown table operation: {0}".format(operation))
+    if len({(table.kmer_size, table.canonical) for table in tables}) > 1:
+        raise ValueError("The tables hold kmers of different sizes or "
+                         "canonical modes.")
+    return _merge_table_chunks(tables, operation, chunk_size)
+
+
+def _merge_table_chunks(tables, operation, chunk_size):
+    """Generate the chunks of merge_kmer_tables.
+
+    :param tables: (list) A list of SortedKmerTable.
+    :param operation: (str) One of sum, min, intersection and difference.
+    :param chunk_size: (int) Number of kmers taken from each table at once.
+    :return: A generator of sorted (codes, counts) chunks.
+    """
+    nb_words = tables[0].nb_words
+    cursors = [0] * len(tables)
+    while True:
+        remaining = [cursor < len(table)
+                     for table, cursor in zip(tables, cursors)]
+        if operation == "sum":
+            done = not any(remaining)
+        elif operation == "difference":
+            done = not remaining[0]
+        else:
+            done = not all(remaining)
+        if done:
+            return
+        lasts = np.array([table.words[min(cursor + chunk_size, len(table)) - 1]
+                          for table, cursor, left in zip(tables, cursors,
+                                                         remaining) if left])
+        lasts = lasts[:, 0] if nb_words == 1 else lasts
+        bound = lasts[_sort_order(lasts)[:1]]
+        words, counts, sources = [], [], []
+        for number, table in enumerate(tables):
+            end = int(table.rank(bound)[0])
+            if end < len(table) and (table.words[end] == bound).all():
+                end += 1
+            words.append(table.words[cursors[number]:end])
+            counts.append(table.counts[cursors[number]:end].astype(np.int64))
+            sources.append(np.full(end - cursors[number], number))
+            cursors[number] = end
+        words = np.concatenate(words)
+        codes = words[:, 0] if nb_words == 1 else words
+        # A stable sort keeps the kmers of the first table first in their run
+        order = _sort_order(codes)
+        codes = codes[order]
+        counts = np.concatenate(counts)[order]
+        sources = np.concatenate(sources)[order]
+        changes = codes[1:] != codes[:-1]
+        if nb_words > 1:
+            changes = changes.any(axis=1)
+        starts = np.flatnonzero(np.concatenate(([True], changes)))
+        lengths = np.diff(np.append(starts, len(codes)))
+        if operation == "sum":
+            kept = np.ones(len(starts), dtype=bool)
+        elif operation == "difference":
+            kept = (lengths == 1) & (sources[starts] == 0)
+        else:
+            kept = lengths == len(tables)
+        if operation == "min":
+            counts = np.minimum.reduceat(counts, starts)
+        else:
+            counts = np.add.reduceat(counts, starts)
+        if kept.any():
+            yield codes[starts[kept]], counts[kept]
+
+
+def merge_kmer_files(table_files, output_file, operation="sum"):
+    """Merge table files of kmer occurrences into a new table file.
+
+    The tables are mapped in memory and merged chunk by chunk (see
+    merge_kmer_tables), so that the memory used does not grow with their
+    size.
+
+    :param table_files: (list) Paths to the table files (see
+                        write_kmer_chunks).
+    :param output_file: (str) Path to the merged table file.
+    :param operation: (str) One of sum, min, intersection and difference.
+    :raises ValueError: If the tables have other kmer sizes or canonical
+                        modes, or for an unknown operation
+    :return: (SortedKmerTable) The merged table, mapped.
+    """
+    tables = [load_kmer_table(table_file) for table_file in table_files]
+    if operation == "sum":
+        max_kmers = sum(len(table) for table in tables)
+    elif operation == "difference":
+        max_kmers = len(tables[0])
+    else:
+        max_kmers = min(len(table) for table in tables)
+    write_kmer_chunks(output_file, tables[0].kmer_size,
+                      merge_kmer_tables(tables, operation), max_kmers,
+                      tables[0].canonical)
+    return load_kmer_table(output_file)
+
+
+def combine_kmer_tables(kmer_dict, kmer_size, canonical=False,
+                        table_files=(), subtract_files=()):
+    """Add and subtract table files to counted kmer occurrences.
+
+    :param kmer_dict: A dictionnary object that identify all kmer
+                      occurrences (KmerTable or SortedKmerTable), None to
+                      start from the table files.
+    :param kmer_size: (int) Size of the kmers.
+    :param canonical: (boolean) True->The kmers were counted canonical
+    :param table_files: (list) Paths to table files (see write_kmer_chunks)
+                        whose counts are added (see merge_kmer_tables).
+    :param subtract_files: (list) Paths to table files whose kmers are
+                           removed, e.g. kmers of a host or contaminant.
+    :raises ValueError: If a table file has another kmer size or canonical
+                        mode
+    :return: (SortedKmerTable) The combined table of kmer occurrences.
+    """
+    tables = [_load_matching_table(table_file, kmer_size, canonical)
+              for table_file in table_files]
+    subtracted = [_load_matching_table(table_file, kmer_size, canonical)
+                  for table_file in subtract_files]
+    if kmer_dict is not None:
+        if not isinstance(kmer_dict, SortedKmerTable):
+            kmer_dict = SortedKmerTable(kmer_size, *kmer_dict.to_arrays(),
+                                        canonical)
+        tables.insert(0, kmer_dict)
+    if not tables:
+        table = SortedKmerTable(kmer_size, np.empty(0, dtype=np.uint64),
+                                np.empty(0, dtype=np.int64), canonical)
+    elif len(tables) == 1:
+        table = tables[0]
+    else:
+        table = SortedKmerTable.from_chunks(
+            kmer_size, merge_kmer_tables(tables), canonical)
+    if subtracted:
+        table = SortedKmerTable.from_chunks(
+            kmer_size, merge_kmer_tables([table] + subtracted, "difference"),
+            canonical)
+    return table
+
+
+def kmer_histogram(kmer_dict):
+    """Compute the abundance histogram (spectrum) of counted kmers.
+
+    :param kmer_dict: A dictionnary object that identify all kmer
+                      occurrences (KmerTable or dict).
+    :return: (np.ndarray) Number of distinct kmers seen each number of
+             times, indexed by the number of times.
+    """
+    if isinstance(kmer_dict, KmerTable):
+        counts = kmer_dict.counts[kmer_dict.used]
+    elif isinstance(kmer_dict, SortedKmerTable):
+        counts = kmer_dict.counts
+    else:
+        counts = np.fromiter(kmer_dict.values(), dtype=np.int64,
+                             count=len(kmer_dict))
+    return np.bincount(counts.astype(np.intp), minlength=2)
+
+
+def find_solid_threshold(histogram):
+    """Find the minimum count of the solid kmers in an abundance histogram.
+
+    The kmers holding sequencing errors make a peak at count 1 that falls
+    until a valley before the peak of the genome kmers at the sequencing
+    coverage; the threshold is the bottom of that valley.
+
+    :param histogram: (np.ndarray) Number of distinct kmers by count.
+    :return: (int) Minimum count of the solid kmers, None when the
+             histogram has no valley.
+    """
+    count = 1
+    while (count + 1 < len(histogram)
+           and histogram[count + 1] <= histogram[count]):
+        count += 1
+    if count + 1 >= len(histogram):
+        return None
+    return count
+
+
+def filter_kmer_dict(kmer_dict, min_count):
+    """Remove the kmers seen fewer than min_count times.
+
+    :param kmer_dict: A dictionnary object that identify all kmer
+                      occurrences (KmerTable, SortedKmerTable or dict).
+    :param min_count: (int) Minimum count of the kmers kept.
+    :return: A dictionnary object of the same kind with the kmers kept.
+    """
+    if min_count <= 1:
+        return kmer_dict
+    if isinstance(kmer_dict, SortedKmerTable):
+        solid = kmer_dict.counts >= min_count
+        return SortedKmerTable(kmer_dict.kmer_size, kmer_dict.words[solid],
+                               kmer_dict.counts[solid], kmer_dict.canonical)
+    if isinstance(kmer_dict, KmerTable):
+        codes, counts = kmer_dict.to_arrays()
+        solid = counts >= min_count
+        return KmerTable.from_arrays(kmer_dict.kmer_size, codes[solid],
+                                     counts[solid])
+    return {kmer: count for kmer, count in kmer_dict.items()
+            if count >= min_count}
+
+
+def kmer_spectrum(fastq_file, kmer_sizes, nb_reads=None, trimming=None,
+                  canonical=False):
+    """Compute the abundance histograms of several kmer sizes.
+
+    The reads (or the first nb_reads of them) are loaded once and counted
+    for each kmer size.
+
+    :param fastq_file: (str) Path to the fastq file, or a list of read
+                       sources (see read_fastq).
+    :param kmer_sizes: (list) Sizes of the kmers.
+    :param nb_reads: (int) Number of reads of the sample, None for all.
+    :param trimming: (dict) Parameters of trim_read_blocks, None to keep
+                     the reads as they are.
+    :param canonical: (boolean) True->Count each kmer with its reverse
+                      complement
+    :return: (dict) Abundance histogram (see kmer_histogram) of each kmer
+             size.
+    """
+    blocks = load_read_blocks(fastq_file, trimming=trimming)
+    if nb_reads is not None:
+        blocks = sample_read_blocks(blocks, nb_reads)
+    blocks = list(blocks)
+    return {kmer_size: kmer_histogram(count_read_blocks(blocks, kmer_size,
+                                                        canonical))
+            for kmer_size in kmer_sizes}
+
+
+def suggest_kmer_size(histograms):
+    """Pick the kmer size giving the most distinct solid kmers.
+
+    The sizes whose histogram has no valley (see find_solid_threshold) are
+    left out: their error kmers can not be told from the solid ones.
+
+    :param histograms: (dict) Abundance histogram of each kmer size.
+    :return: (int, list) The suggested kmer size, None when no histogram
+             has a valley, and a (kmer size, solid threshold, number of
+             solid kmers) tuple for each size, with None for both numbers
+             of the sizes without a valley.
+    """
+    summary = []
+    for kmer_size, histogram in sorted(histograms.items()):
+        threshold = find_solid_threshold(histogram)
+        nb_solid = None
+        if threshold is not None:
+            nb_solid = int(histogram[threshold:].sum())
+        summary.append((kmer_size, threshold, nb_solid))
+    candidates = [row for row in summary if row[1] is not None]
+    if not candidates:
+        return None, summary
+    return max(candidates, key=itemgetter(2))[0], summary
+
+
+def save_histogram(histograms, output_file):
+    """Write abundance histograms as a tab-separated table.
+
+    :param histograms: (dict) Abundance histogram of each kmer size.
+    :param output_file: (str) Path to the output file.
+    """
+    with open(output_file, 'w') as file:
+        file.write("kmer_size\tcount\tnb_kmers\n")
+        for kmer_size, histogram in sorted(histograms.items()):
+            for count in np.flatnonzero(histogram):
+                file.write(f"{kmer_size}\t{count}\t{histogram[count]}\n")
+
+
+def build_graph(kmer_dict, canonical=False):
     """Build the debruijn graph
 
     :param kmer_dict: A dictionnary object that identify all kmer occurrences.
+    :param canonical: (boolean) True->The kmers are canonical, each one
+                      stands for both strands: the graph holds the edges of
+                      the kmers and of their reverse complements, both
+                      strands of a region being read as twin paths
     :return: A directed graph (nx) of all kmer substring and weight (occurrence).
     """
-    graph = nx.DiGraph()
+    return update_graph(nx.DiGraph(), kmer_dict, canonical)
 
-    for kmer, count in kmer_dict.items():
+
+def update_graph(graph, kmer_dict, canonical=False):
+    """Add kmer occurrences to a debruijn graph
+
+    The weights of the edges of kmers already in the graph are raised by
+    their new occurrences, so that a graph built from a table can follow
+    its updates (see update_kmer_table).
+
+    :param graph: (nx.DiGraph) A debruijn graph, updated in place.
+    :param kmer_dict: A dictionnary object of the new kmer occurrences.
+    :param canonical: (boolean) True->The kmers are canonical (see
+                      build_graph)
+    :return: The updated graph.
+    """
+    items = kmer_dict.items()
+    if canonical:
+        items = _both_strands(items)
+    for kmer, count in items:
     
         prefix = kmer[:-1]
         suffix = kmer[1:]
@@ -140,8 +3331,23 @@ def build_graph(kmer_dict):
             graph.add_edge(prefix, suffix, weight=count)
             
     return graph
-    
-    pass
+
+
+def _both_strands(items):
+    """Expand canonical kmer occurrences to the kmers of both strands.
+
+    :param items: An iterable object of (kmer, count) tuples.
+    :return: A generator object that iterate (kmer, count) tuples, the
+             reverse complement of each kmer following it (palindromes
+             come once).
+    """
+    for kmer, count in items:
+        yield kmer, count
+        kmer_size = len(kmer)
+        twin = decode_kmer(reverse_complement_code(encode_kmer(kmer), kmer_size),
+                           kmer_size)
+        if twin != kmer:
+            yield twin, count
 
 
 def remove_paths(graph, path_list, delete_entry_node, delete_sink_node):
@@ -332,15 +3538,19 @@ def get_sink_nodes(graph):
     return list_sink_nodes
     pass
 
-def get_contigs(graph, starting_nodes, ending_nodes):
+def get_contigs(graph, starting_nodes, ending_nodes, canonical=False):
     """Extract the contigs from the graph
 
     :param graph: (nx.DiGraph) A directed graph object 
     :param starting_nodes: (list) A list of nodes without predecessors
     :param ending_nodes: (list) A list of nodes without successors
+    :param canonical: (boolean) True->The graph holds both strands (see
+                      build_graph), a contig whose reverse complement was
+                      already extracted is skipped
     :return: (list) List of [contiguous sequence and their length]
     """
     list_tuple_contigs = []
+    seen_contigs = set()
     
     for node_start in starting_nodes:
         for node_target in ending_nodes:
@@ -357,6 +3567,10 @@ def get_contigs(graph, starting_nodes, ending_nodes):
                         else:
                             contig_sequence += node[-1]
                    
+                    if canonical:
+                        if reverse_complement(contig_sequence) in seen_contigs:
+                            continue
+                        seen_contigs.add(contig_sequence)
                     list_tuple_contigs.append((contig_sequence,len(contig_sequence)))
                         
     return list_tuple_contigs        
@@ -411,13 +3625,125 @@ def main(): # pragma: no cover
     """
     # Get arguments
     args = get_arguments()
-    kmer_dict = build_kmer_dict(args.fastq_file, 200)
-    graph = build_graph(kmer_dict)
+    trimming = None
+    if args.min_quality is not None or args.min_length > 0:
+        trimming = {"min_quality": args.min_quality or 0,
+                    "window": args.window, "min_length": args.min_length}
+    normalization = None
+    if args.coverage is not None:
+        normalization = {"coverage": args.coverage, "width": args.sketch_width,
+                         "depth": args.sketch_depth}
+    if args.kmer_sizes:
+        histograms = kmer_spectrum(args.fastq_file, args.kmer_sizes,
+                                   args.sample_size, trimming, args.canonical)
+        if args.histogram_file:
+            save_histogram(histograms, args.histogram_file)
+        best_size, summary = suggest_kmer_size(histograms)
+        print("k\tmin_count\tsolid_kmers", file=sys.stderr)
+        for kmer_size, threshold, nb_solid in summary:
+            if threshold is None:
+                threshold = nb_solid = "no valley"
+            print(f"{kmer_size}\t{threshold}\t{nb_solid}", file=sys.stderr)
+        if best_size is None:
+            sys.exit("No k-mer size has a valley in its abundance "
+                     "histogram, try a larger --sample.")
+        print(f"Suggested k-mer size: {best_size}")
+        return
+    if args.benchmark:
+        print("engine\tseconds\tdistinct_kmers", file=sys.stderr)
+        for engine, seconds, nb_distinct in benchmark_engines(
+                args.fastq_file, args.kmer_size, args.canonical, trimming,
+                args.cache_dir):
+            print(f"{engine}\t{seconds:.2f}\t{nb_distinct}", file=sys.stderr)
+        return
+    kmer_estimate = None
+    if args.presize or args.estimate_only:
+        if "-" in args.fastq_file:
+            sys.exit("Standard input can not be read twice to presize "
+                     "the counting.")
+        kmer_estimate = estimate_distinct_kmers(
+            args.fastq_file, args.kmer_size, args.canonical, trimming,
+            args.cache_dir)
+        nb_distinct, nb_kmers = kmer_estimate
+        nbytes = KmerTable.table_nbytes(args.kmer_size, nb_distinct * 1.05)
+        print(f"Estimated distinct k-mers: {nb_distinct} (of {nb_kmers} "
+              f"k-mers), k-mer table of {nbytes / (1 << 20):.1f} MiB",
+              file=sys.stderr)
+        if args.estimate_only:
+            return
+    if (args.bloom_error_rate is not None and kmer_estimate is None
+            and args.fastq_file and "-" in args.fastq_file):
+        print("Warning: the number of k-mers of standard input is unknown, "
+              "the Bloom filter is sized for 16777216 k-mers.",
+              file=sys.stderr)
+    if (args.max_memory is not None and args.fastq_file
+            and "-" in args.fastq_file):
+        print("Warning: the size of standard input is unknown, its k-mers "
+              "are not counted to split the counting under --max-memory "
+              "into bucket files.", file=sys.stderr)
+    sketch = None
+    if args.approximate is not None:
+        sketch = CountMinSketch(args.sketch_width, args.sketch_depth)
+    counting = {"processes": args.threads, "normalization": normalization,
+                "max_memory": args.max_memory, "tmp_dir": args.tmp_dir,
+                "bloom_error_rate": args.bloom_error_rate, "sketch": sketch,
+                "min_count": args.approximate, "kmer_estimate": kmer_estimate,
+                "engine": args.engine, "pipeline": args.pipeline,
+                "index_reads": args.index_reads}
+    if args.fastq_file is None:
+        kmer_dict = None
+    elif args.table_file:
+        try:
+            kmer_dict, _ = update_kmer_table(args.table_file, args.fastq_file,
+                                             args.kmer_size, args.canonical,
+                                             args.cache_dir, trimming,
+                                             **counting)
+        except ValueError as error:
+            sys.exit(str(error))
+    else:
+        try:
+            kmer_dict = build_kmer_dict(args.fastq_file, args.kmer_size,
+                                        cache_dir=args.cache_dir,
+                                        trimming=trimming,
+                                        canonical=args.canonical, **counting)
+        except ValueError as error:
+            sys.exit(str(error))
+    if args.merge_tables or args.subtract_tables:
+        try:
+            kmer_dict = combine_kmer_tables(kmer_dict, args.kmer_size,
+                                            args.canonical,
+                                            args.merge_tables or (),
+                                            args.subtract_tables or ())
+        except ValueError as error:
+            sys.exit(str(error))
+    if sketch is not None:
+        error, probability = sketch.error_bound()
+        print("Approximate k-mer counts exceed true counts by at most {0:.1f} "
+              "with probability {1:.4f}".format(error, 1 - probability),
+              file=sys.stderr)
+    if args.save_table_file:
+        save_kmer_table(kmer_dict, args.save_table_file, args.canonical)
+    if args.histogram_file:
+        save_histogram({args.kmer_size: kmer_histogram(kmer_dict)},
+                       args.histogram_file)
+    if args.min_count is not None:
+        min_count = args.min_count
+        if min_count == "auto":
+            min_count = find_solid_threshold(kmer_histogram(kmer_dict))
+            if min_count is None:
+                print("No valley in the k-mer abundance histogram, all "
+                      "k-mers are kept.", file=sys.stderr)
+                min_count = 1
+            else:
+                print(f"Minimum k-mer count: {min_count}", file=sys.stderr)
+        kmer_dict = filter_kmer_dict(kmer_dict, min_count)
+    graph = build_graph(kmer_dict, args.canonical)
     
     list_start_nodes = get_starting_nodes(graph)
     list_sink_nodes = get_sink_nodes(graph)
     
-    list_tuple_contigs = get_contigs(graph, list_start_nodes, list_sink_nodes)
+    list_tuple_contigs = get_contigs(graph, list_start_nodes, list_sink_nodes,
+                                     args.canonical)
     save_contigs(list_tuple_contigs, args.output_file)
     
     # Fonctions de dessin du graphe
@@ -9,6 +9,7 @@ from debruijn import get_starting_nodes
 from debruijn import get_sink_nodes
 from debruijn import get_contigs
 from debruijn import save_contigs
+from debruijn import build_graph
 
 
 def test_get_starting_nodes():
@@ -56,4 +57,10 @@ def test_save_contigs():
     contig = [("TCAGCGAT", 8), ("TCAGCGAA",8), ("ACAGCGAT", 8), ("ACAGCGAA", 8)]
     save_contigs(contig, test_file)
     with open(test_file, 'rb') as contig_test:
-        assert hashlib.md5(contig_test.read()).hexdigest() == "ca84dfeb5d58eca107e34de09b3cc997"
\ No newline at end of file
+        assert hashlib.md5(contig_test.read()).hexdigest() == "ca84dfeb5d58eca107e34de09b3cc997"
+
+def test_get_contigs_canonical():
+    graph = build_graph({"TCAG": 1, "CAGG": 1, "ACCT": 1}, canonical=True)
+    contig_list = get_contigs(graph, get_starting_nodes(graph), get_sink_nodes(graph), canonical=True)
+    assert len(contig_list) == 1
+    assert contig_list[0][0] in ("TCAGGT", "ACCTGA")
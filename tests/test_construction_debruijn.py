@@ -1,14 +1,76 @@
 """Tests for graph build"""
 import pytest
+import argparse
+import bz2
+import gzip
+import io
+import lzma
 import os
+import random
+import shutil
+import sys
 import networkx as nx
+import numpy as np
 # import pickle
 from .context import debruijn
 #from .context import debruijn_comp
 from debruijn import read_fastq
+from debruijn import iter_fastq_blocks
+from debruijn import iter_fasta_blocks
+from debruijn import iter_in_thread
+from debruijn import expand_inputs
 from debruijn import cut_kmer
+from debruijn import cut_kmer_codes
+from debruijn import cut_superkmer
+from debruijn import cut_superkmer_block
+from debruijn import encode_kmer
+from debruijn import decode_kmer
+from debruijn import encode_read_block
+from debruijn import count_read_blocks
+from debruijn import KmerTable
+from debruijn import kmer_histogram
+from debruijn import find_solid_threshold
+from debruijn import filter_kmer_dict
+from debruijn import kmer_spectrum
+from debruijn import suggest_kmer_size
+from debruijn import save_histogram
+from debruijn import sample_read_blocks
+from debruijn import decode_kmer_codes
+from debruijn import reverse_complement
+from debruijn import reverse_complement_code
+from debruijn import reverse_complement_codes
 from debruijn import build_kmer_dict
+from debruijn import index_fastq
+from debruijn import find_record_start
+from debruijn import split_fastq
+from debruijn import shard_kmer_counts
+from debruijn import shard_bounds
+from debruijn import positive_int
+from debruijn import non_negative_int
+from debruijn import count_kmers_external
+from debruijn import max_bucket_files
+from debruijn import estimate_kmer_number
+from debruijn import BloomFilter
+from debruijn import CountMinSketch
+from debruijn import HyperLogLog
+from debruijn import estimate_distinct_kmers
+from debruijn import iter_read_blocks
+from debruijn import read_fastq_range
+from debruijn import iter_read_cache
+from debruijn import trim_read_blocks
+from debruijn import normalize_read_blocks
 from debruijn import build_graph
+from debruijn import update_graph
+from debruijn import update_kmer_table
+from debruijn import load_kmer_table
+from debruijn import TABLE_VERSION
+from debruijn import main
+from debruijn import save_kmer_table
+from debruijn import count_kmers_sorted
+from debruijn import SortedKmerTable
+from debruijn import merge_kmer_tables
+from debruijn import merge_kmer_files
+from debruijn import combine_kmer_tables
 
 
 def test_read_fastq():
@@ -49,3 +111,567 @@ def test_build_graph():
     assert "AG" in graph
     assert "GA" in graph
     assert graph.edges["AG", "GA"]['weight'] == 2
+
+
+def test_read_fastq_bytes():
+    """Test fastq reading as raw bytes"""
+    fastq_reader = read_fastq(os.path.abspath(os.path.join(os.path.dirname(__file__), "test_two_reads.fq")), as_bytes=True)
+    assert next(fastq_reader).startswith(b"TCAGAGCTCTAGAG")
+    assert next(fastq_reader).startswith(b"TTTGAATTACAACA")
+    with pytest.raises(StopIteration):
+        next(fastq_reader)
+
+
+def test_iter_fastq_blocks():
+    """Test records split across block boundaries"""
+    data = b"@r1\nACGT\n+\nJJJJ\n@r2\nGGCA\n+\nJJJJ\n@r3\nTTA\n+\nJJJ"
+    for block_size in (1, 5, 13, len(data)):
+        blocks = list(iter_fastq_blocks(io.BytesIO(data), block_size))
+        sequences = [seq for seqs, _ in blocks for seq in seqs]
+        qualities = [qual for _, quals in blocks for qual in quals]
+        assert sequences == [b"ACGT", b"GGCA", b"TTA"]
+        assert qualities == [b"JJJJ", b"JJJJ", b"JJJ"]
+    with pytest.raises(ValueError):
+        list(iter_fastq_blocks(io.BytesIO(data[:-6])))
+
+
+@pytest.mark.parametrize("opener", [gzip.open, bz2.open, lzma.open])
+def test_read_fastq_compressed(tmp_path, opener):
+    """Test reading of compressed fastq files"""
+    fastq_file = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_two_reads.fq"))
+    compressed_file = str(tmp_path / "reads.fq.compressed")
+    with open(fastq_file, "rb") as filin, opener(compressed_file, "wb") as filout:
+        filout.write(filin.read())
+    assert list(read_fastq(compressed_file)) == list(read_fastq(fastq_file))
+
+
+def test_iter_in_thread():
+    """Test background production of items"""
+    assert list(iter_in_thread(iter(range(100)), 2)) == list(range(100))
+    def failing():
+        yield 1
+        raise ValueError("broken stream")
+    reader = iter_in_thread(failing())
+    assert next(reader) == 1
+    with pytest.raises(ValueError):
+        next(reader)
+
+
+def test_index_fastq(tmp_path):
+    """Test record index and range splitting"""
+    fastq_file = str(tmp_path / "reads.fq")
+    with open(fastq_file, "wb") as filout:
+        filout.write(b"@r1\nACGT\n+\n@JJJ\n@r2\nGGCA\n+\nJJJJ\n@r3\nTTA\n+\nJJJ\n")
+    index = index_fastq(fastq_file, persist=True)
+    assert list(index) == [0, 16, 32]
+    assert os.path.isfile(fastq_file + ".fqi")
+    assert list(index_fastq(fastq_file)) == [0, 16, 32]
+    with open(fastq_file, "rb") as filin:
+        data = filin.read()
+    assert find_record_start(data, 1) == 16
+    assert find_record_start(data, 33) == len(data)
+    for nb_chunks in (1, 2, 3, 5):
+        for ranges in (split_fastq(fastq_file, nb_chunks),
+                       split_fastq(fastq_file, nb_chunks, index)):
+            sequences = [seq for start, end in ranges
+                         for seqs, _ in read_fastq_range(fastq_file, start, end)
+                         for seq in seqs]
+            assert sequences == [b"ACGT", b"GGCA", b"TTA"]
+    empty_file = str(tmp_path / "empty.fq")
+    open(empty_file, "wb").close()
+    assert split_fastq(empty_file, 2) == []
+    assert split_fastq(empty_file, 2, index_fastq(empty_file)) == []
+
+
+def test_build_kmer_dict_processes(tmp_path):
+    """Test counting with several worker processes"""
+    fastq_file = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_two_reads.fq"))
+    assert build_kmer_dict(fastq_file, 3, processes=2) == build_kmer_dict(fastq_file, 3)
+    assert build_kmer_dict(fastq_file, 40, processes=3) == build_kmer_dict(fastq_file, 40)
+    indexed_file = str(tmp_path / "reads.fq")
+    shutil.copyfile(fastq_file, indexed_file)
+    assert build_kmer_dict(indexed_file, 3, processes=2, index_reads=True) == build_kmer_dict(fastq_file, 3)
+    assert os.path.isfile(indexed_file + ".fqi")
+    empty_file = str(tmp_path / "empty.fq")
+    open(empty_file, "wb").close()
+    assert len(build_kmer_dict(empty_file, 3, processes=2)) == 0
+
+
+def test_read_fastq_inputs(tmp_path, monkeypatch):
+    """Test reading several files, glob patterns and standard input"""
+    fastq_file = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_two_reads.fq"))
+    build_file = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_build.fq"))
+    reads = list(read_fastq(fastq_file)) + list(read_fastq(build_file))
+    assert list(read_fastq([fastq_file, build_file])) == reads
+    assert expand_inputs([os.path.join(os.path.dirname(fastq_file), "test_*.fq"), "-"]) == [
+        build_file, fastq_file, "-"]
+    with pytest.raises(argparse.ArgumentTypeError):
+        expand_inputs([str(tmp_path / "*.fq")])
+    with open(fastq_file, "rb") as filin:
+        stdin = io.BufferedReader(io.BytesIO(gzip.compress(filin.read())))
+    monkeypatch.setattr(sys, "stdin", io.TextIOWrapper(stdin))
+    assert list(read_fastq(["-", build_file])) == reads
+
+
+def test_read_fasta():
+    """Test reading of single and multi-line fasta files"""
+    data = b">r1 first\nACGT\nGG\n>r2\nTTAC\n\n>r3\nC\nA\nT\n"
+    for block_size in (1, 3, 7, len(data)):
+        blocks = list(iter_fasta_blocks(io.BytesIO(data), block_size))
+        assert [seq for seqs, _ in blocks for seq in seqs] == [b"ACGTGG", b"TTAC", b"CAT"]
+    genome = list(read_fastq(os.path.abspath(os.path.join(os.path.dirname(__file__), "../data/eva71.fna"))))
+    assert len(genome) == 1
+    assert len(genome[0]) == 7408
+    assert genome[0].startswith("TTAAAACAGCTGTGGGTTGTC")
+
+
+def test_read_cache(tmp_path):
+    """Test the packed 2-bit read cache"""
+    fastq_file = str(tmp_path / "reads.fq")
+    with open(fastq_file, "wb") as filout:
+        filout.write(b"@r1\nACGTTGCA\n+\nJJJJJJJJ\n@r2\nGGNCAT\n+\nJJJJJJ\n@r3\nTTA\n+\nJJJ\n")
+    cache_dir = str(tmp_path / "cache")
+    reads = ["ACGTTGCA", "GG", "CAT", "TTA"]
+    assert list(read_fastq(fastq_file, cache_dir=cache_dir)) == reads
+    cache_files = sorted(os.listdir(cache_dir))
+    assert [os.path.splitext(name)[1] for name in cache_files] == [".2bit", ".idx"]
+    assert os.path.getsize(os.path.join(cache_dir, cache_files[0])) == 4
+    assert list(read_fastq(fastq_file, cache_dir=cache_dir)) == reads
+    for block_size in (1, 5):
+        cache_prefix = os.path.join(cache_dir, os.path.splitext(cache_files[0])[0])
+        assert [seq for seqs, _ in iter_read_cache(cache_prefix, block_size)
+                for seq in seqs] == [read.encode() for read in reads]
+
+
+def test_trim_read_blocks():
+    """Test quality trimming, N splitting and length filtering"""
+    blocks = [([b"ACGTACGTAC", b"GGGNNCCCCA", b"TTAG"],
+               [b"IIIIII####", b"IIIIIIIIII", b"####"])]
+    trimmed = list(trim_read_blocks(blocks, min_quality=20, window=2, min_length=3))
+    assert trimmed == [([b"ACGTAC", b"GGG", b"CCCCA"], [b"IIIIII", b"III", b"IIIII"])]
+    trimmed = list(trim_read_blocks([([b"ACNGTT", b"AC"], None)], min_length=2))
+    assert trimmed == [([b"AC", b"GTT", b"AC"], None)]
+    # Reads shorter than the window are trimmed as a single window
+    trimmed = list(trim_read_blocks([([b"ACG", b"ACG"], [b"II#", b"###"])], min_quality=20))
+    assert trimmed == [([b"ACG"], [b"II#"])]
+    with pytest.raises(ValueError):
+        list(trim_read_blocks(blocks, min_quality=20, window=0))
+    assert positive_int("4") == 4 and non_negative_int("0") == 0
+    for value in ("0", "-1", "four"):
+        with pytest.raises(argparse.ArgumentTypeError):
+            positive_int(value)
+    with pytest.raises(argparse.ArgumentTypeError):
+        non_negative_int("-1")
+
+
+def test_normalize_read_blocks():
+    """Test digital normalization of redundant reads"""
+    read = b"TCAGAGCTCTAGAGTTGGTTCTGAGAGAGATCGG"
+    other = b"TTTGAATTACAACATCCATATGTTCTTGATGCTG"
+    blocks = [([read] * 10 + [other], None), ([read, other, b"TC"], None)]
+    normalized = list(normalize_read_blocks(blocks, 21, coverage=3, width=1024))
+    assert normalized == [([read] * 3 + [other], None), ([other], None)]
+
+
+def test_cut_kmer_codes():
+    """Test integer encoding of kmers"""
+    assert encode_kmer("TCA") == 0b110100
+    assert decode_kmer(0b110100, 3) == "TCA"
+    assert decode_kmer(encode_kmer("A" * 40 + "T"), 41) == "A" * 40 + "T"
+    assert [decode_kmer(code, 3) for code in cut_kmer_codes("TCAGANGATC", 3)] == [
+        "TCA", "CAG", "AGA", "GAT", "ATC"]
+    assert list(cut_kmer_codes(b"TCAGA", 3)) == [encode_kmer(kmer) for kmer in cut_kmer("TCAGA", 3)]
+
+
+def test_build_kmer_dict_kmer_size():
+    """Test counting with the requested kmer size"""
+    fastq_file = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_two_reads.fq"))
+    for kmer_size in (5, 21, 40):
+        kmer_dict = {}
+        for read in read_fastq(fastq_file):
+            for kmer in cut_kmer(read, kmer_size):
+                kmer_dict[kmer] = kmer_dict.get(kmer, 0) + 1
+        assert build_kmer_dict(fastq_file, kmer_size) == kmer_dict
+        assert build_kmer_dict(fastq_file, kmer_size, engine="sort") == kmer_dict
+
+
+def test_count_kmers_sorted():
+    """Test sort-based and pipelined counting"""
+    fastq_file = os.path.abspath(os.path.join(os.path.dirname(__file__), "../data/eva71_hundred_reads.fq"))
+    blocks = list(iter_read_blocks(fastq_file))
+    for kmer_size in (21, 40):
+        for canonical in (False, True):
+            table = count_read_blocks(blocks, kmer_size, canonical)
+            codes, counts = count_kmers_sorted(blocks, kmer_size, canonical, run_size=1000)
+            expected_codes, expected_counts = table.to_arrays()
+            assert (codes == expected_codes).all()
+            assert (counts == expected_counts).all()
+            codes, counts = count_kmers_sorted(iter_read_blocks(fastq_file), kmer_size, canonical,
+                                               run_size=1000, pipeline=True)
+            assert (codes == expected_codes).all()
+            assert (counts == expected_counts).all()
+            assert count_read_blocks(iter_read_blocks(fastq_file), kmer_size, canonical, pipeline=True) == table
+
+
+def test_encode_read_block():
+    """Test vectorized encoding and counting of kmers"""
+    sequences = [b"TCAGANGATC", b"GA", b"AGATCAGAGCTTAGGCTAACGTAGCAATGCA"]
+    for kmer_size in (1, 3, 7, 21, 32, 33):
+        expected = [code for seq in sequences for code in cut_kmer_codes(seq, kmer_size)]
+        codes = encode_read_block(sequences, kmer_size)
+        assert decode_kmer_codes(codes, kmer_size) == [decode_kmer(code, kmer_size) for code in expected]
+        if kmer_size <= 32:
+            assert codes.tolist() == expected
+    long_reads = sequences + [b"TCAGAGCTCTAGAGTTGGTTCTGAGAGAGATCGGTTACTCGAGCTTAGGCTAACGTAGCAATGCAAGTCGATCGATCGGATCC"]
+    for kmer_size in (64, 65, 75):
+        expected = [decode_kmer(code, kmer_size) for seq in long_reads for code in cut_kmer_codes(seq, kmer_size)]
+        assert decode_kmer_codes(encode_read_block(long_reads, kmer_size), kmer_size) == expected
+        assert decode_kmer_codes(encode_read_block(long_reads, kmer_size, canonical=True), kmer_size) == [
+            min(kmer, reverse_complement(kmer)) for kmer in expected]
+    codes, counts = count_read_blocks([(sequences[:2], None), (sequences[2:], None)], 3).to_arrays()
+    assert decode_kmer_codes(codes, 3)[:2] == ["AAC", "AAT"]
+    assert counts[decode_kmer_codes(codes, 3).index("AGA")] == 3
+
+
+def test_kmer_table():
+    """Test the array-backed table of kmer occurrences"""
+    for kmer_size in (3, 40):
+        rng = random.Random(kmer_size)
+        pool = ["".join(rng.choice("ACGT") for _ in range(kmer_size)) for _ in range(2000)]
+        kmer_dict = {}
+        table = KmerTable(kmer_size)
+        for _ in range(6):
+            kmers = [rng.choice(pool) for _ in range(500)]
+            codes = [encode_kmer(kmer) for kmer in kmers]
+            table.add_codes(np.array(codes, dtype=np.uint64 if kmer_size <= 32 else object))
+            for kmer in kmers:
+                kmer_dict[kmer] = kmer_dict.get(kmer, 0) + 1
+        assert table == kmer_dict
+        assert len(table) == len(kmer_dict)
+        assert dict(table.items()) == kmer_dict
+        assert "N" * kmer_size not in table and "A" not in table
+        codes, counts = table.to_arrays()
+        assert KmerTable.from_arrays(kmer_size, codes, counts) == kmer_dict
+        assert table.get_counts(codes).tolist() == counts.tolist()
+    assert table.used.sum() < table.MAX_LOAD * len(table.used)
+
+
+def test_reverse_complement_code():
+    """Test reverse complement of encoded kmers"""
+    for kmer in ("TCAGA", "A" * 32, "ACGTTGCAGGCTAGCTAGGATCGACTACGACT", "TCAGAGCTCTAGAGTTGGTTCTGAGAGAGATCGGTTACTCG"):
+        twin = encode_kmer(reverse_complement(kmer))
+        assert reverse_complement_code(encode_kmer(kmer), len(kmer)) == twin
+        codes = encode_read_block([kmer.encode()], len(kmer))
+        assert decode_kmer_codes(reverse_complement_codes(codes, len(kmer)), len(kmer)) == [reverse_complement(kmer)]
+
+
+def test_build_kmer_dict_canonical(tmp_path):
+    """Test canonical counting of reads of both strands"""
+    fastq_file = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_two_reads.fq"))
+    both_strands = str(tmp_path / "both_strands.fq")
+    with open(both_strands, "w") as filout:
+        for index, read in enumerate(read_fastq(fastq_file)):
+            filout.write("@r{0}\n{1}\n+\n{2}\n".format(index, reverse_complement(read), "J" * len(read)))
+    for kmer_size in (5, 33):
+        forward = build_kmer_dict(fastq_file, kmer_size, canonical=True)
+        assert build_kmer_dict(both_strands, kmer_size, canonical=True) == forward
+        assert all(kmer <= reverse_complement(kmer) for kmer in forward)
+
+
+def test_kmer_histogram(tmp_path):
+    """Test the abundance histogram and the solid kmer threshold"""
+    kmer_dict = {"AAA": 1, "AAC": 1, "ACG": 2, "CGT": 5, "GTT": 5}
+    assert kmer_histogram(kmer_dict).tolist() == [0, 2, 1, 0, 0, 2]
+    table = KmerTable.from_arrays(3, np.array([encode_kmer(kmer) for kmer in kmer_dict], dtype=np.uint64),
+                                  np.array(list(kmer_dict.values())))
+    assert kmer_histogram(table).tolist() == [0, 2, 1, 0, 0, 2]
+    assert find_solid_threshold(np.array([0, 900, 120, 30, 45, 80, 60])) == 3
+    assert find_solid_threshold(np.array([0, 900, 120, 30, 10])) is None
+    assert filter_kmer_dict(kmer_dict, 2) == {"ACG": 2, "CGT": 5, "GTT": 5}
+    assert filter_kmer_dict(table, 3) == {"CGT": 5, "GTT": 5}
+    fastq_file = os.path.abspath(os.path.join(os.path.dirname(__file__), "../data/eva71_hundred_reads.fq"))
+    histograms = kmer_spectrum(fastq_file, [11, 21], nb_reads=50)
+    sample = sample_read_blocks(iter_read_blocks(fastq_file), 50)
+    assert histograms[21].tolist() == kmer_histogram(count_read_blocks(sample, 21)).tolist()
+    best_size, summary = suggest_kmer_size(histograms)
+    # Too few reads to separate the error kmers at both sizes
+    assert best_size is None and summary == [(11, None, None), (21, None, None)]
+    valley = np.array([0, 900, 120, 30, 45, 80, 60])
+    no_valley = np.array([0, 900, 800, 700, 600, 500])
+    assert suggest_kmer_size({21: valley, 31: no_valley}) == (
+        21, [(21, 3, 215), (31, None, None)])
+    assert suggest_kmer_size({31: no_valley}) == (None, [(31, None, None)])
+    histogram_file = str(tmp_path / "histogram.tsv")
+    save_histogram(histograms, histogram_file)
+    with open(histogram_file) as filin:
+        lines = filin.read().splitlines()
+    assert lines[0] == "kmer_size\tcount\tnb_kmers"
+    assert lines[1] == "11\t1\t{0}".format(histograms[11][1])
+
+
+def test_main_merge(tmp_path, monkeypatch):
+    """Test the command line on stored tables alone, without reads"""
+    fastq_file = os.path.abspath(os.path.join(os.path.dirname(__file__), "../data/eva71_hundred_reads.fq"))
+    table_file = str(tmp_path / "reads.kmers")
+    save_kmer_table(build_kmer_dict(fastq_file, 21), table_file)
+    contigs_file = str(tmp_path / "contigs.fasta")
+    monkeypatch.setattr(sys, "argv", ["debruijn.py", "--merge", table_file, "-k", "21",
+                                      "--max-memory", "1G", "-o", contigs_file])
+    main()
+    assert os.path.getsize(contigs_file) > 0
+    # No sketch is reported for tables that were not counted here
+    monkeypatch.setattr(sys, "argv", ["debruijn.py", "--merge", table_file, "-k", "21",
+                                      "--approximate", "-o", contigs_file])
+    with pytest.raises(SystemExit):
+        main()
+
+
+def test_update_kmer_table(tmp_path):
+    """Test incremental counting into a stored table"""
+    fastq_file = os.path.abspath(os.path.join(os.path.dirname(__file__), "../data/eva71_hundred_reads.fq"))
+    with open(fastq_file) as filin:
+        lines = filin.readlines()
+    lanes = [str(tmp_path / "lane1.fq"), str(tmp_path / "lane2.fq")]
+    for lane, part in zip(lanes, (lines[:200], lines[200:])):
+        with open(lane, "w") as filout:
+            filout.writelines(part)
+    table_file = str(tmp_path / "table.kmers")
+    table, first = update_kmer_table(table_file, lanes[0], 21)
+    assert table == first == build_kmer_dict(lanes[0], 21)
+    graph = build_graph(table)
+    table, second = update_kmer_table(table_file, lanes[1], 21)
+    assert table == build_kmer_dict(fastq_file, 21)
+    stored = load_kmer_table(table_file)
+    assert stored == table and not stored.canonical
+    update_graph(graph, second)
+    expected = build_graph(build_kmer_dict(fastq_file, 21))
+    assert sorted(graph.edges(data="weight")) == sorted(expected.edges(data="weight"))
+    with pytest.raises(ValueError):
+        update_kmer_table(table_file, lanes[1], 21, canonical=True)
+    # The counting options of build_kmer_dict apply to the new reads
+    normalization = {"coverage": 2, "width": 1 << 16, "depth": 4}
+    table, new_table = update_kmer_table(str(tmp_path / "normalized.kmers"), lanes[0], 21,
+                                         normalization=normalization, engine="sort")
+    assert table == new_table == build_kmer_dict(lanes[0], 21, normalization=normalization)
+    assert sum(table.values()) < sum(first.values())
+
+
+def test_sorted_kmer_table(tmp_path):
+    """Test the sorted table files and their batch lookups"""
+    fastq_file = os.path.abspath(os.path.join(os.path.dirname(__file__), "../data/eva71_hundred_reads.fq"))
+    for kmer_size in (21, 40):
+        table = build_kmer_dict(fastq_file, kmer_size)
+        table_file = str(tmp_path / "table{}.kmers".format(kmer_size))
+        save_kmer_table(table, table_file, canonical=True)
+        stored = load_kmer_table(table_file)
+        assert stored == table and stored.canonical
+        # The arrays of a loaded table are views on the mapped file
+        assert not any(array.flags.owndata for array in (stored.words, stored.counts, stored.index))
+        assert stored.kmer_size == kmer_size
+        codes, counts = table.to_arrays()
+        assert (stored.lookup(codes) == counts).all()
+        absent = encode_read_block([b"A" * (kmer_size + 5)], kmer_size)
+        assert (stored.lookup(absent) == 0).all()
+        assert "A" * kmer_size not in stored
+    table_file = str(tmp_path / "empty.kmers")
+    save_kmer_table(KmerTable(21), table_file)
+    stored = load_kmer_table(table_file)
+    assert len(stored) == 0 and dict(stored) == {}
+    assert len(stored.lookup(absent[:0])) == 0
+    with open(table_file, "r+b") as filout:
+        filout.seek(8)
+        filout.write(np.array([TABLE_VERSION + 1], dtype="<u4").tobytes())
+    with pytest.raises(ValueError):
+        load_kmer_table(table_file)
+
+
+def test_merge_kmer_tables(tmp_path):
+    """Test merges and set operations over sorted tables"""
+    fastq_file = os.path.abspath(os.path.join(os.path.dirname(__file__), "../data/eva71_hundred_reads.fq"))
+    with open(fastq_file) as filin:
+        lines = filin.readlines()
+    for kmer_size in (21, 40):
+        lanes, table_files = [], []
+        for number, part in enumerate((lines[:200], lines[160:])):
+            lane = str(tmp_path / "lane{}.fq".format(number))
+            with open(lane, "w") as filout:
+                filout.writelines(part)
+            lanes.append(dict(build_kmer_dict(lane, kmer_size)))
+            table_files.append(str(tmp_path / "lane{}.kmers".format(number)))
+            save_kmer_table(build_kmer_dict(lane, kmer_size), table_files[-1])
+        first, second = lanes
+        merged = merge_kmer_files(table_files, str(tmp_path / "merged.kmers"))
+        assert merged == {kmer: first.get(kmer, 0) + second.get(kmer, 0)
+                          for kmer in set(first) | set(second)}
+        tables = [load_kmer_table(table_file) for table_file in table_files]
+        assert SortedKmerTable.from_chunks(kmer_size, merge_kmer_tables(tables, "min", chunk_size=100)) == {
+            kmer: min(count, second[kmer]) for kmer, count in first.items() if kmer in second}
+        assert SortedKmerTable.from_chunks(kmer_size, merge_kmer_tables(tables, "intersection", chunk_size=7)) == {
+            kmer: count + second[kmer] for kmer, count in first.items() if kmer in second}
+        assert SortedKmerTable.from_chunks(kmer_size, merge_kmer_tables(tables, "difference", chunk_size=100)) == {
+            kmer: count for kmer, count in first.items() if kmer not in second}
+        assert combine_kmer_tables(None, kmer_size, False, table_files[1:], table_files[:1]) == {
+            kmer: count for kmer, count in second.items() if kmer not in first}
+    with pytest.raises(ValueError):
+        merge_kmer_tables(tables, "union")
+    with pytest.raises(ValueError):
+        combine_kmer_tables(build_kmer_dict(fastq_file, 21), 21, False, table_files)
+    # Tables merged alone are checked against the kmer size and canonical mode
+    with pytest.raises(ValueError):
+        combine_kmer_tables(None, 21, False, table_files)
+    with pytest.raises(ValueError):
+        combine_kmer_tables(None, 40, True, table_files)
+    canonical_file = str(tmp_path / "canonical.kmers")
+    save_kmer_table(build_kmer_dict(fastq_file, 40, canonical=True), canonical_file, True)
+    assert combine_kmer_tables(None, 40, True, [canonical_file]).canonical
+    with pytest.raises(ValueError):
+        combine_kmer_tables(None, 40, False, table_files[:1], [canonical_file])
+
+
+def test_build_graph_canonical():
+    graph = build_graph({"AGA": 2, "ACG": 1}, canonical=True)
+    assert graph.edges["AG", "GA"]['weight'] == 2
+    assert graph.edges["TC", "CT"]['weight'] == 2
+    assert graph.edges["AC", "CG"]['weight'] == 1
+    assert graph.edges["CG", "GT"]['weight'] == 1
+    assert graph.number_of_edges() == 4
+
+
+def test_shard_kmer_counts():
+    """Test range partitioning of kmer tables"""
+    codes = np.arange(0, 4 ** 5, 3, dtype=np.uint64)
+    bounds = shard_bounds(np.empty(0, dtype=np.uint64), 4, 5)
+    assert bounds.tolist() == [256, 512, 768]
+    shards = shard_kmer_counts((codes, np.ones(len(codes), dtype=np.int64)), bounds)
+    assert len(shards) == 4
+    assert [code for shard, _ in shards for code in shard.tolist()] == codes.tolist()
+    assert all(len(shard) > 0 for shard, _ in shards)
+    other = shard_kmer_counts((codes[::2], np.ones(len(codes[::2]), dtype=np.int64)), bounds)
+    for (shard, _), (other_shard, _) in zip(shards, other):
+        assert set(other_shard.tolist()) <= set(shard.tolist())
+    rows = encode_read_block([b"ACGT" * 30], 40)
+    rows = rows[np.lexsort(rows.T[::-1])]
+    shards = shard_kmer_counts((rows, np.ones(len(rows), dtype=np.int64)), shard_bounds(rows, 3, 40))
+    assert np.array_equal(np.concatenate([shard for shard, _ in shards]), rows)
+    # Quantiles of a sample balance the skewed canonical codes
+    fastq_file = os.path.abspath(os.path.join(os.path.dirname(__file__), "../data/eva71_plus_perfect.fq"))
+    codes, counts = build_kmer_dict(fastq_file, 21, canonical=True).to_arrays()
+    sample = codes[np.sort(np.random.default_rng(0).choice(len(codes), len(codes) // 10, replace=False))]
+    sizes = [len(shard) for shard, _ in shard_kmer_counts((codes, counts), shard_bounds(sample, 8, 21))]
+    assert sum(sizes) == len(codes) and max(sizes) < 1.5 * min(sizes)
+
+
+def test_cut_superkmer():
+    """Test minimizer-based super-kmers"""
+    read = "TCAGAGCTCTAGAGTTGGTTCTGAGAGAGATCGGTTACTCGAGCTTAGGCTAACGTAGCAATGCA"
+    superkmers = list(cut_superkmer(read, 9, 4))
+    assert [kmer for _, superkmer in superkmers for kmer in cut_kmer(superkmer, 9)] == list(cut_kmer(read, 9))
+    assert all(first != second for (first, _), (second, _) in zip(superkmers, superkmers[1:]))
+    assert len(superkmers) < len(read) - 8
+    for canonical in (False, True):
+        sequences = [read.encode(), b"GATTN" + read[::-1].encode(), b"ACG"]
+        bases, starts, ends, minimizers = cut_superkmer_block(sequences, 9, 4, canonical)
+        expected = [item for seq in (read, read[::-1]) for item in cut_superkmer(seq, 9, 4, canonical)]
+        assert [(minimizer, bases[start:end].tolist()) for start, end, minimizer in zip(starts, ends, minimizers.tolist())] == [
+            (minimizer, [encode_kmer(base) for base in superkmer]) for minimizer, superkmer in expected]
+    for sequences in ([b"ACGTA", b"ACGT"], [b"ACGTNACGTAN"]):
+        _, starts, ends, minimizers = cut_superkmer_block(sequences, 7, 3)
+        assert len(starts) == len(ends) == len(minimizers) == 0
+
+
+def test_count_kmers_external(tmp_path):
+    """Test counting through bucket files"""
+    fastq_file = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_two_reads.fq"))
+    expected = count_read_blocks(iter_read_blocks(fastq_file), 7, canonical=True).to_arrays()
+    for nb_buckets in (1, 5):
+        table = count_kmers_external(iter_read_blocks(fastq_file), 7, nb_buckets,
+                                     canonical=True, tmp_dir=str(tmp_path))
+        codes, counts = table.to_arrays()
+        assert codes.tolist() == expected[0].tolist()
+        assert counts.tolist() == expected[1].tolist()
+    assert os.listdir(str(tmp_path)) == []
+    assert build_kmer_dict(fastq_file, 5, max_memory=20000) == build_kmer_dict(fastq_file, 5)
+    assert build_kmer_dict(fastq_file, 40, max_memory=20000) == build_kmer_dict(fastq_file, 40)
+    assert len(build_kmer_dict(fastq_file, 127, max_memory=1000)) == 0
+    # The table counts in the budget, presized or growing
+    with pytest.raises(ValueError):
+        build_kmer_dict(fastq_file, 40, max_memory=1000)
+    with pytest.raises(ValueError):
+        build_kmer_dict(fastq_file, 40, max_memory=20000, kmer_estimate=(10000, 10000))
+    assert 0 < max_bucket_files() < 1 << 20
+    expected = count_read_blocks(iter_read_blocks(fastq_file), 7)
+    presized = KmerTable(7, len(expected))
+    nb_slots = len(presized.counts)
+    assert count_kmers_external(iter_read_blocks(fastq_file), 7, 5, processes=2,
+                                table=presized) is presized
+    assert len(presized.counts) == nb_slots
+    assert presized == expected
+
+
+def test_estimate_kmer_number(tmp_path):
+    """Test the estimate of the number of kmers from the size of the files"""
+    fasta_file = os.path.abspath(os.path.join(os.path.dirname(__file__), "../data/eva71.fna"))
+    fastq_file = os.path.abspath(os.path.join(os.path.dirname(__file__), "../data/eva71_hundred_reads.fq"))
+    gzip_file = str(tmp_path / "reads.fq.gz")
+    with open(fastq_file, "rb") as filin, gzip.open(gzip_file, "wb") as filout:
+        filout.write(filin.read())
+    assert estimate_kmer_number([fasta_file]) == os.path.getsize(fasta_file)
+    assert estimate_kmer_number([fastq_file]) == os.path.getsize(fastq_file) // 2
+    assert estimate_kmer_number([gzip_file, "-"]) == 2 * os.path.getsize(gzip_file)
+
+
+def test_bloom_filter():
+    """Test the Bloom filter of kmers seen once"""
+    bloom = BloomFilter(1000, 0.01)
+    keys = np.arange(500, dtype=np.uint64)
+    assert not bloom.add(keys).any()
+    assert bloom.add(keys).all()
+    assert bloom.add(np.arange(10000, 11000, dtype=np.uint64)).sum() < 50
+    blocks = [([b"TCAGAGA", b"GGGGG"], None), ([b"TCAGCCC", b"AGAG"], None)]
+    assert count_read_blocks(blocks, 3, bloom=BloomFilter(100, 0.001)) == {
+        "TCA": 2, "CAG": 2, "AGA": 3, "GAG": 2, "GGG": 3}
+
+
+def test_build_kmer_dict_bloom(monkeypatch):
+    """Test the Bloom filter sized on the distinct kmers of the reads"""
+    fastq_file = os.path.abspath(os.path.join(os.path.dirname(__file__), "../data/eva71_hundred_reads.fq"))
+    capacities = []
+
+    def bloom_filter(capacity, error_rate=0.01):
+        capacities.append(capacity)
+        return BloomFilter(capacity, error_rate)
+    monkeypatch.setattr(debruijn, "BloomFilter", bloom_filter)
+    table = build_kmer_dict(fastq_file, 21, bloom_error_rate=0.001)
+    assert table == filter_kmer_dict(build_kmer_dict(fastq_file, 21), 2)
+    nb_distinct = len(build_kmer_dict(fastq_file, 21))
+    assert abs(capacities[0] - nb_distinct) < 0.1 * nb_distinct
+
+
+def test_hyperloglog():
+    """Test distinct kmer estimation to presize the counting"""
+    estimator = HyperLogLog(12)
+    keys = np.arange(0, 70000, 7, dtype=np.uint64)
+    estimator.add(keys)
+    estimator.add(keys[:5000])
+    assert abs(estimator.estimate() - 10000) < 500
+    fastq_file = os.path.abspath(os.path.join(os.path.dirname(__file__), "../data/eva71_hundred_reads.fq"))
+    exact = build_kmer_dict(fastq_file, 21)
+    nb_distinct, nb_kmers = estimate_distinct_kmers(fastq_file, 21)
+    assert abs(nb_distinct - len(exact)) < 0.05 * len(exact)
+    assert nb_kmers == sum(exact.values())
+    table = build_kmer_dict(fastq_file, 21, kmer_estimate=(nb_distinct, nb_kmers))
+    assert table == exact
+    assert len(table.used) == len(KmerTable(21, int(nb_distinct * 1.05)).used)
+
+
+def test_count_kmers_approximate():
+    """Test approximate counting in a Count-Min sketch"""
+    fastq_file = os.path.abspath(os.path.join(os.path.dirname(__file__), "../data/eva71_hundred_reads.fq"))
+    exact = build_kmer_dict(fastq_file, 15)
+    sketch = CountMinSketch(1 << 12, 4)
+    approximate = build_kmer_dict(fastq_file, 15, sketch=sketch, min_count=2)
+    error, _ = sketch.error_bound()
+    assert set(approximate) >= {kmer for kmer, count in exact.items() if count >= 2}
+    for kmer, count in approximate.items():
+        assert exact[kmer] <= count <= exact[kmer] + error
+    assert sketch.total == sum(exact.values())